@@ -0,0 +1,37 @@
+from kubernetes_asyncio import client, config
+
+_api_client: client.ApiClient | None = None
+_k8s_api = None
+_core_v1_api = None
+
+
+async def _get_api_client() -> client.ApiClient:
+    global _api_client
+    if _api_client is None:
+        try:
+            config.load_incluster_config()
+        except Exception:  # noqa: BLE001
+            await config.load_kube_config()
+        _api_client = client.ApiClient()
+    return _api_client
+
+
+async def get_k8s_api():
+    global _k8s_api
+    if _k8s_api is None:
+        _k8s_api = client.AppsV1Api(await _get_api_client())
+    return _k8s_api
+
+
+async def get_core_v1_api():
+    global _core_v1_api
+    if _core_v1_api is None:
+        _core_v1_api = client.CoreV1Api(await _get_api_client())
+    return _core_v1_api
+
+
+async def close_k8s_client() -> None:
+    global _api_client, _k8s_api, _core_v1_api
+    if _api_client is not None:
+        await _api_client.close()
+    _api_client = _k8s_api = _core_v1_api = None
@@ -1,152 +1,161 @@
+import asyncio
 import json
 import logging
 import os
-import time
+import uuid
 from typing import List
 
-from kubernetes import client, config
-from kubernetes.client.rest import ApiException
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.rest import ApiException
 
-from settings import NAMESPACE
+from k8s_client import get_core_v1_api, get_k8s_api
+from node_cache import get_node_address
+from pod_informer import (
+    game_server_exited,
+    is_pod_ready,
+    list_pods,
+    session_node_name,
+    session_pods,
+    wait_for_session_ready,
+)
+from settings import GAME_SERVER_MODE, NAMESPACE
+from storage import allocate_host_port
 
 logger = logging.getLogger(__name__)
 
-_k8s_api = None
+WARM_POOL_NAME_PREFIX = "game-server-warm-"
+# Multi-session servers: server_id "shared-<hex>", object name "game-server-shared-<hex>".
+SHARED_SERVER_ID_PREFIX = "shared-"
+# Player traffic (exposed via NodePort/hostPort) and backend-only commands (pod IP only).
+GAME_SERVER_PORT = 8080
+GAME_SERVER_CONTROL_PORT = 8081
 
 
-def _load_k8s_config() -> None:
-    try:
-        config.load_incluster_config()
-    except Exception:  # noqa: BLE001
-        config.load_kube_config()
+async def wait_for_game_server_ready(session_id: str, timeout_seconds: float = 45.0) -> bool:
+    return await wait_for_session_ready(session_id, timeout_seconds)
 
 
-def get_k8s_api():
-    global _k8s_api
-    if _k8s_api is None:
-        _load_k8s_config()
-        _k8s_api = client.AppsV1Api()
-    return _k8s_api
+def game_server_name(session_id: str) -> str:
+    return f"game-server-{session_id[:8]}"
 
 
-def get_core_v1_api():
-    if not hasattr(get_core_v1_api, "_api"):
-        _load_k8s_config()
-        get_core_v1_api._api = client.CoreV1Api()
-    return get_core_v1_api._api
+def _pod_mode() -> bool:
+    return GAME_SERVER_MODE == "pod"
 
 
-def wait_for_game_server_ready(session_id: str, timeout_seconds: float = 45.0) -> bool:
-    core_api = get_core_v1_api()
-    label_selector = f"app=game-server,session_id={session_id}"
-    deadline = time.time() + timeout_seconds
-
-    while time.time() < deadline:
-        try:
-            pods = core_api.list_namespaced_pod(
-                namespace=NAMESPACE,
-                label_selector=label_selector,
+def _build_pod_spec(env: dict, restart_policy: str, host_port: int | None = None) -> client.V1PodSpec:
+    return client.V1PodSpec(
+        containers=[
+            client.V1Container(
+                name="game-server",
+                image="game-server:local",
+                image_pull_policy="IfNotPresent",
+                ports=[
+                    client.V1ContainerPort(container_port=GAME_SERVER_PORT, host_port=host_port, protocol="TCP"),
+                    client.V1ContainerPort(container_port=GAME_SERVER_CONTROL_PORT, name="control", protocol="TCP"),
+                ],
+                env=[client.V1EnvVar(name=k, value=v) for k, v in env.items()],
             )
-            for pod in pods.items:
-                status = pod.status
-                if status is None or status.phase != "Running":
-                    continue
-                if any(cs.ready for cs in (status.container_statuses or [])):
-                    return True
-        except Exception as e:  # noqa: BLE001
-            logger.warning(f"Error while waiting for game server readiness ({session_id}): {e}")
-        time.sleep(0.5)
-    return False
-
-
-def create_game_server_pod(session_id: str, players: List[str]) -> tuple[str, str, int]:
-    k8s_apps_api = get_k8s_api()
-    core_api = get_core_v1_api()
+        ],
+        restart_policy=restart_policy,
+    )
 
-    pod_name = f"game-server-{session_id[:8]}"
-    logger.info(f"Creating game server pod {pod_name} in namespace {NAMESPACE}")
 
-    deployment = client.V1Deployment(
+def _build_deployment(name: str, labels: dict, selector: dict, env: dict) -> client.V1Deployment:
+    return client.V1Deployment(
         metadata=client.V1ObjectMeta(
-            name=pod_name,
+            name=name,
             namespace=NAMESPACE,
-            labels={"app": "game-server", "session_id": session_id},
+            labels=labels,
         ),
         spec=client.V1DeploymentSpec(
             replicas=1,
-            selector=client.V1LabelSelector(
-                match_labels={"app": "game-server", "session_id": session_id}
-            ),
+            selector=client.V1LabelSelector(match_labels=selector),
             template=client.V1PodTemplateSpec(
-                metadata=client.V1ObjectMeta(
-                    labels={"app": "game-server", "session_id": session_id}
-                ),
-                spec=client.V1PodSpec(
-                    containers=[
-                        client.V1Container(
-                            name="game-server",
-                            image="game-server:local",
-                            image_pull_policy="IfNotPresent",
-                            ports=[client.V1ContainerPort(container_port=8080)],
-                            env=[
-                                client.V1EnvVar(name="SESSION_ID", value=session_id),
-                                client.V1EnvVar(name="PLAYERS", value=json.dumps(players)),
-                                client.V1EnvVar(name="PORT", value="8080"),
-                            ],
-                        )
-                    ],
-                    restart_policy="Always",
-                ),
+                metadata=client.V1ObjectMeta(labels=labels),
+                spec=_build_pod_spec(env, "Always"),
             ),
         ),
     )
 
+
+def _build_pod(name: str, labels: dict, env: dict, host_port: int) -> client.V1Pod:
+    """Pod mode: one API object per game server, exposed on hostPort and never restarted."""
+    return client.V1Pod(
+        metadata=client.V1ObjectMeta(
+            name=name,
+            namespace=NAMESPACE,
+            labels={**labels, "host_port": str(host_port)},
+        ),
+        spec=_build_pod_spec(env, "Never", host_port),
+    )
+
+
+def _pod_host_port(pod) -> int:
     try:
-        k8s_apps_api.create_namespaced_deployment(namespace=NAMESPACE, body=deployment)
-        logger.info(f"Successfully created deployment {pod_name}")
+        return int(pod.spec.containers[0].ports[0].host_port or 0)
+    except (AttributeError, IndexError, TypeError):
+        return 0
+
+
+async def _create_host_port_pod(name: str, labels: dict, env: dict) -> int:
+    """Create a bare game-server Pod; returns its hostPort (the existing one on a 409)."""
+    core_api = await get_core_v1_api()
+    host_port = await allocate_host_port()
+    try:
+        await core_api.create_namespaced_pod(namespace=NAMESPACE, body=_build_pod(name, labels, env, host_port))
+        logger.info(f"Created game server pod {name} on hostPort {host_port}")
+        return host_port
     except ApiException as e:
-        logger.error(f"Failed to create deployment: status={e.status}, reason={e.reason}, body={e.body}")
         if e.status != 409:
             raise
+    return _pod_host_port(await core_api.read_namespaced_pod(name=name, namespace=NAMESPACE))
+
+
+def _service_node_port(svc) -> int:
+    return (svc.spec.ports[0].node_port if svc.spec and svc.spec.ports else 0) or 0
+
 
+async def _create_node_port_service(name: str, labels: dict, selector: dict) -> int | None:
+    """Create the NodePort Service for a game server. Returns its node port, or None on failure."""
+    core_api = await get_core_v1_api()
     svc = client.V1Service(
         metadata=client.V1ObjectMeta(
-            name=pod_name,
+            name=name,
             namespace=NAMESPACE,
-            labels={"app": "game-server", "session_id": session_id},
+            labels=labels,
         ),
         spec=client.V1ServiceSpec(
             type="NodePort",
-            selector={"app": "game-server", "session_id": session_id},
+            selector=selector,
             ports=[client.V1ServicePort(port=8080, target_port=8080, protocol="TCP")],
         ),
     )
     try:
-        core_api.create_namespaced_service(namespace=NAMESPACE, body=svc)
-        logger.info(f"Created Service {pod_name} (NodePort)")
+        created = await core_api.create_namespaced_service(namespace=NAMESPACE, body=svc)
+        logger.info(f"Created Service {name} (NodePort)")
+        return _service_node_port(created)
     except ApiException as e:
         if e.status != 409:
-            logger.warning(f"Failed to create Service for {pod_name}: {e}")
-            return pod_name, "", 0
+            logger.warning(f"Failed to create Service for {name}: {e}")
+            return None
+    return await _read_node_port(name)
 
-    time.sleep(0.5)
+
+async def _read_node_port(name: str) -> int:
     try:
-        created = core_api.read_namespaced_service(name=pod_name, namespace=NAMESPACE)
-        node_port = created.spec.ports[0].node_port if created.spec.ports else 0
+        core_api = await get_core_v1_api()
+        return _service_node_port(await core_api.read_namespaced_service(name=name, namespace=NAMESPACE))
     except Exception:  # noqa: BLE001
-        node_port = 0
+        return 0
+
 
+async def _resolve_connect_host(node_name: str | None = None) -> str:
+    """Connect host for a game server scheduled on node_name (any node when unknown)."""
     connect_host = os.getenv("GAME_SERVER_CONNECT_HOST", "")
     if not connect_host:
         try:
-            nodes = core_api.list_node()
-            for node in nodes.items:
-                for addr in node.status.addresses or []:
-                    if addr.type in ("ExternalIP", "InternalIP"):
-                        connect_host = addr.address
-                        break
-                if connect_host:
-                    break
+            connect_host = await get_node_address(node_name)
         except Exception as e:  # noqa: BLE001
             logger.warning(f"Failed to auto-detect node IP for game server connect_host: {e}")
     if not connect_host:
@@ -154,20 +163,316 @@ def create_game_server_pod(session_id: str, players: List[str]) -> tuple[str, st
         logger.warning(
             "Falling back to localhost for game-server connect_host; this may be unreachable for NodePort clients"
         )
+    return connect_host
+
+
+async def create_game_server_pod(session_id: str, players: List[str]) -> tuple[str, str, int]:
+    k8s_apps_api = await get_k8s_api()
+
+    pod_name = game_server_name(session_id)
+    logger.info(f"Creating game server pod {pod_name} in namespace {NAMESPACE}")
+
+    labels = {"app": "game-server", "session_id": session_id}
+    if _pod_mode():
+        host_port = await _create_host_port_pod(
+            pod_name,
+            labels,
+            {"SESSION_ID": session_id, "PLAYERS": json.dumps(players), "PORT": "8080"},
+        )
+        if not await wait_for_game_server_ready(session_id, timeout_seconds=45.0):
+            logger.warning(f"Game server {pod_name} not ready within timeout; clients may need to retry connect")
+        # hostPort is only reachable on the pod's own node.
+        return pod_name, await _resolve_connect_host(session_node_name(session_id)), host_port
+
+    deployment = _build_deployment(
+        pod_name,
+        labels,
+        labels,
+        {"SESSION_ID": session_id, "PLAYERS": json.dumps(players), "PORT": "8080"},
+    )
 
-    if not wait_for_game_server_ready(session_id, timeout_seconds=45.0):
+    try:
+        await k8s_apps_api.create_namespaced_deployment(namespace=NAMESPACE, body=deployment)
+        logger.info(f"Successfully created deployment {pod_name}")
+    except ApiException as e:
+        logger.error(f"Failed to create deployment: status={e.status}, reason={e.reason}, body={e.body}")
+        if e.status != 409:
+            raise
+
+    node_port = await _create_node_port_service(pod_name, labels, labels)
+    if node_port is None:
+        return pod_name, "", 0
+
+    if not await wait_for_game_server_ready(session_id, timeout_seconds=45.0):
         logger.warning(f"Game server {pod_name} not ready within timeout; clients may need to retry connect")
+    connect_host = await _resolve_connect_host(session_node_name(session_id))
+
+    return pod_name, connect_host, node_port
+
+
+async def create_warm_game_server() -> str:
+    """Start an idle game server (Deployment + NodePort Service) that a session can claim later."""
+    warm_id = uuid.uuid4().hex[:8]
+    name = f"{WARM_POOL_NAME_PREFIX}{warm_id}"
+    labels = {"app": "game-server", "pool": "warm", "warm_id": warm_id}
+    selector = {"app": "game-server", "warm_id": warm_id}
+
+    if _pod_mode():
+        await _create_host_port_pod(name, labels, {"PORT": "8080"})
+        logger.info(f"Created warm game server {name}")
+        return name
+
+    k8s_apps_api = await get_k8s_api()
+    await k8s_apps_api.create_namespaced_deployment(
+        namespace=NAMESPACE,
+        body=_build_deployment(name, labels, selector, {"PORT": "8080"}),
+    )
+    await _create_node_port_service(name, labels, selector)
+    logger.info(f"Created warm game server {name}")
+    return name
+
+
+async def list_warm_game_servers() -> List[str]:
+    """Names of warm-pool servers that have not been claimed yet."""
+    if _pod_mode():
+        warm = [
+            pod for pod in list_pods(lambda pod: (pod.metadata.labels or {}).get("pool") == "warm")
+            if not pod.metadata.deletion_timestamp
+        ]
+        # Bare pods are never restarted: delete exited ones so they stop counting toward the pool.
+        for pod in warm:
+            if game_server_exited(pod):
+                try:
+                    await _delete_bare_pod(pod.metadata.name)
+                except ApiException as e:
+                    logger.warning(f"Failed to delete exited warm pod {pod.metadata.name}: {e}")
+        return [pod.metadata.name for pod in warm if not game_server_exited(pod)]
+    # A warm server whose container restarted has exited once; the reconciler
+    # would end any session claiming it, so retire its Deployment instead.
+    restarted = {
+        f"{WARM_POOL_NAME_PREFIX}{(pod.metadata.labels or {}).get('warm_id', '')}"
+        for pod in list_pods(lambda pod: (pod.metadata.labels or {}).get("pool") == "warm")
+        if game_server_exited(pod) and not pod.metadata.deletion_timestamp
+    }
+    k8s_apps_api = await get_k8s_api()
+    deployments = await k8s_apps_api.list_namespaced_deployment(
+        namespace=NAMESPACE,
+        label_selector="app=game-server,pool=warm",
+    )
+    names = [dep.metadata.name for dep in deployments.items]
+    for name in restarted.intersection(names):
+        try:
+            await delete_game_server_pod("", name)
+        except ApiException as e:
+            logger.warning(f"Failed to delete restarted warm game server {name}: {e}")
+    return [name for name in names if name not in restarted]
+
+
+async def _mark_pod(pod, labels: dict) -> bool:
+    """Patch pod labels guarded by resourceVersion so only one backend replica wins."""
+    body = {"metadata": {"resourceVersion": pod.metadata.resource_version, "labels": labels}}
+    try:
+        core_api = await get_core_v1_api()
+        await core_api.patch_namespaced_pod(name=pod.metadata.name, namespace=NAMESPACE, body=body)
+        return True
+    except ApiException as e:
+        if e.status not in (404, 409):
+            logger.warning(f"Failed to patch warm pod {pod.metadata.name}: {e}")
+        return False
+
+
+async def _send_command(pod_ip: str, command: str, timeout: float = 2.0) -> str:
+    """One-line request/reply on the game server's control port ("" on connection failure)."""
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(pod_ip, GAME_SERVER_CONTROL_PORT), timeout=timeout
+        )
+        writer.write(f"{command}\n".encode())
+        await writer.drain()
+        return (await asyncio.wait_for(reader.readline(), timeout=timeout)).decode().strip()
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.warning(f"{command.split()[0]} to {pod_ip} failed: {e}")
+        return ""
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def _send_assign_session(pod_ip: str, session_id: str, timeout: float = 2.0) -> bool:
+    return await _send_command(pod_ip, f"ASSIGN_SESSION {session_id}", timeout) == f"ASSIGNED {session_id}"
+
+
+def _ready_warm_pods() -> list:
+    return list_pods(
+        lambda pod: (pod.metadata.labels or {}).get("pool") == "warm"
+        and is_pod_ready(pod)
+        and bool(pod.status.pod_ip)
+        and not game_server_exited(pod)
+    )
+
+
+async def claim_warm_game_server(session_id: str) -> tuple[str, str, int] | None:
+    """Bind a ready warm-pool server to session_id. Returns None when the pool is empty."""
+    for pod in _ready_warm_pods():
+        warm_id = (pod.metadata.labels or {}).get("warm_id", "")
+        if not warm_id or not await _mark_pod(pod, {"pool": "claimed", "session_id": session_id}):
+            continue
+        name = f"{WARM_POOL_NAME_PREFIX}{warm_id}"
+        if not await _send_assign_session(pod.status.pod_ip, session_id):
+            await delete_game_server_pod(session_id, name)
+            continue
+        if _pod_mode():
+            logger.info(f"Session {session_id} claimed warm game server {name}")
+            return name, await _resolve_connect_host(pod.spec.node_name), _pod_host_port(pod)
+        try:
+            k8s_apps_api = await get_k8s_api()
+            await k8s_apps_api.patch_namespaced_deployment(
+                name=name,
+                namespace=NAMESPACE,
+                body={"metadata": {"labels": {"pool": "claimed", "session_id": session_id}}},
+            )
+        except ApiException as e:
+            logger.warning(f"Failed to label claimed deployment {name}: {e}")
+        logger.info(f"Session {session_id} claimed warm game server {name}")
+        return name, await _resolve_connect_host(pod.spec.node_name), await _read_node_port(name)
+    return None
+
+
+async def drain_warm_game_server() -> bool:
+    """Retire one idle warm-pool server, making sure nobody can claim it meanwhile."""
+    for pod in _ready_warm_pods():
+        warm_id = (pod.metadata.labels or {}).get("warm_id", "")
+        if warm_id and await _mark_pod(pod, {"pool": "draining"}):
+            await delete_game_server_pod("", f"{WARM_POOL_NAME_PREFIX}{warm_id}")
+            return True
+    return False
+
+
+def shared_server_name(server_id: str) -> str:
+    return f"game-server-{server_id}"
+
+
+def shared_server_id(name: str | None) -> str | None:
+    """server_id of a shared server object name, None for dedicated/warm servers."""
+    if name and name.startswith(f"game-server-{SHARED_SERVER_ID_PREFIX}"):
+        return name[len("game-server-"):]
+    return None
+
+
+async def create_shared_game_server(max_sessions: int) -> str:
+    """Start an empty multi-session game server; returns its server_id."""
+    server_id = f"{SHARED_SERVER_ID_PREFIX}{uuid.uuid4().hex[:8]}"
+    name = shared_server_name(server_id)
+    labels = {"app": "game-server", "pool": "shared", "server_id": server_id}
+    env = {"PORT": "8080", "MAX_SESSIONS": str(max_sessions)}
+    if _pod_mode():
+        await _create_host_port_pod(name, labels, env)
+    else:
+        selector = {"app": "game-server", "server_id": server_id}
+        k8s_apps_api = await get_k8s_api()
+        await k8s_apps_api.create_namespaced_deployment(
+            namespace=NAMESPACE,
+            body=_build_deployment(name, labels, selector, env),
+        )
+        await _create_node_port_service(name, labels, selector)
+    logger.info(f"Created shared game server {name} for {max_sessions} sessions")
+    return server_id
+
+
+def shared_server_pod(server_id: str):
+    """The ready, still-running pod of a shared server, if any."""
+    for pod in session_pods(server_id):
+        if is_pod_ready(pod) and pod.status.pod_ip and not game_server_exited(pod):
+            return pod
+    return None
+
+
+def ready_shared_servers() -> List[str]:
+    ids = {
+        (pod.metadata.labels or {}).get("server_id", "")
+        for pod in list_pods(lambda pod: (pod.metadata.labels or {}).get("pool") == "shared")
+    }
+    return [server_id for server_id in ids if server_id and shared_server_pod(server_id) is not None]
+
+
+async def shared_server_address(server_id: str) -> tuple[str, int]:
+    pod = shared_server_pod(server_id)
+    connect_host = await _resolve_connect_host(session_node_name(server_id))
+    if _pod_mode():
+        return connect_host, _pod_host_port(pod) if pod is not None else 0
+    return connect_host, await _read_node_port(shared_server_name(server_id))
+
+
+async def assign_session_to_shared_server(server_id: str, session_id: str) -> str:
+    """ASSIGN_SESSION on a shared server: "ok", "full", or "unreachable"."""
+    pod = shared_server_pod(server_id)
+    if pod is None:
+        return "unreachable"
+    reply = await _send_command(pod.status.pod_ip, f"ASSIGN_SESSION {session_id}")
+    if reply == f"ASSIGNED {session_id}":
+        return "ok"
+    return "full" if reply == "ERROR full" else "unreachable"
+
+
+async def end_session_on_shared_server(server_id: str, session_id: str) -> bool:
+    pod = shared_server_pod(server_id)
+    if pod is None:
+        return False
+    reply = await _send_command(pod.status.pod_ip, f"END_SESSION {session_id}")
+    return reply in (f"ENDED {session_id}", "ERROR unknown_session")
+
+
+async def shared_server_capacity(server_id: str) -> tuple[int, int] | None:
+    """(active sessions, max sessions) as reported by the shared server itself."""
+    pod = shared_server_pod(server_id)
+    if pod is None:
+        return None
+    parts = (await _send_command(pod.status.pod_ip, "CAPACITY")).split()
+    if len(parts) != 3 or parts[0] != "CAPACITY":
+        return None
+    try:
+        return int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def exited_shared_servers() -> List[str]:
+    """Shared servers whose game server has exited or crashed (all their sessions are gone)."""
+    ids = {
+        (pod.metadata.labels or {}).get("server_id", "")
+        for pod in list_pods(lambda pod: (pod.metadata.labels or {}).get("pool") == "shared")
+    }
+    return [
+        server_id for server_id in ids
+        if server_id
+        and shared_server_pod(server_id) is None
+        and any(game_server_exited(pod) for pod in session_pods(server_id))
+    ]
+
+
+async def _delete_bare_pod(pod_name: str) -> None:
+    core_api = await get_core_v1_api()
+    try:
+        await core_api.delete_namespaced_pod(name=pod_name, namespace=NAMESPACE)
+        logger.info(f"Successfully deleted game server pod {pod_name}")
+    except ApiException as e:
+        if e.status != 404:
+            raise
+        logger.info(f"Game server pod {pod_name} already deleted")
 
-    return pod_name, connect_host, node_port or 0
 
+async def delete_game_server_pod(session_id: str, pod_name: str | None = None) -> None:
+    pod_name = pod_name or game_server_name(session_id)
+    if _pod_mode():
+        await _delete_bare_pod(pod_name)
+        return
 
-def delete_game_server_pod(session_id: str) -> None:
-    k8s_apps_api = get_k8s_api()
-    core_api = get_core_v1_api()
-    pod_name = f"game-server-{session_id[:8]}"
+    k8s_apps_api = await get_k8s_api()
+    core_api = await get_core_v1_api()
 
     try:
-        core_api.delete_namespaced_service(name=pod_name, namespace=NAMESPACE)
+        await core_api.delete_namespaced_service(name=pod_name, namespace=NAMESPACE)
         logger.info(f"Deleted Service {pod_name}")
     except ApiException as e:
         if e.status != 404:
@@ -176,10 +481,12 @@ def delete_game_server_pod(session_id: str) -> None:
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            k8s_apps_api.delete_namespaced_deployment(
+            await k8s_apps_api.delete_namespaced_deployment(
                 name=pod_name,
                 namespace=NAMESPACE,
-                body=client.V1DeleteOptions(propagation_policy="Foreground"),
+                # Background: return as soon as the Deployment is gone and let
+                # the garbage collector remove its ReplicaSet and pods.
+                body=client.V1DeleteOptions(propagation_policy="Background"),
             )
             logger.info(f"Successfully deleted game server pod {pod_name}")
             return
@@ -190,7 +497,7 @@ def delete_game_server_pod(session_id: str) -> None:
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt
                 logger.warning(f"Failed to delete {pod_name} (attempt {attempt + 1}/{max_retries}): {e}, retrying in {wait_time}s")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 logger.error(f"Failed to delete {pod_name} after {max_retries} attempts: {e}")
                 raise
@@ -1,28 +1,36 @@
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+import asyncio
+import json
 import logging
-import os
-import time
-import uuid
 
-from fastapi import FastAPI, HTTPException
-from kubernetes import client
-from kubernetes.client.rest import ApiException
-
-from k8s_game_server import create_game_server_pod, delete_game_server_pod, get_core_v1_api, get_k8s_api
-from models import MatchRequest, MatchResponse
-from settings import FLUSH_WAIT_SECONDS, MIN_PARTIAL_SESSION_SIZE, NAMESPACE, SESSION_SIZE
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from k8s_client import close_k8s_client
+from match_events import register_waiter, start_match_events, stop_match_events, unregister_waiter
+from matchmaker import start_matchmaker, stop_matchmaker
+from models import EndMatchesRequest, MatchRequest, MatchResponse
+from node_cache import stop_node_cache
+from pod_informer import start_pod_informer, stop_pod_informer
+from provisioning import shutdown_provisioning
+from reconciler import reconcile_orphaned_servers, start_reconciler, stop_reconciler
+from settings import END_BATCH_MAX_SESSIONS
 from storage import (
     append_local_queue,
-    dequeue_players,
-    get_db_conn,
-    get_player_queue_ts_key,
+    close_db_pool,
+    close_redis_client,
+    enqueue_player,
+    get_db_pool,
     get_redis_client,
-    local_dequeue,
-    local_oldest_wait_seconds,
-    local_queue_len,
-    track_session_in_redis,
-    untrack_session_in_redis,
+    get_session_key,
+    lookup_player_session,
+    queue_bucket,
+    scan_active_sessions,
+    session_status_dict,
 )
+from teardown import end_sessions, start_teardown, stop_teardown
+from warm_pool import start_warm_pool, stop_warm_pool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,117 +38,97 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="Game Backend", version="0.1.0")
 
 
-def _create_match_session(players: List[str]) -> MatchResponse:
-    session_id = str(uuid.uuid4())
-    conn = get_db_conn()
-    backend_pod = os.getenv("HOSTNAME", "unknown")
-    players_json = ",".join(players)
-
-    with conn.cursor() as cur:
-        cur.execute(
-            "INSERT INTO matches (session_id, players_json, backend_pod) VALUES (%s, %s, %s)",
-            (session_id, players_json, backend_pod),
-        )
-
-    game_server_pod, connect_host, connect_port = create_game_server_pod(session_id, players)
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE matches SET game_server_pod = %s WHERE session_id = %s",
-            (game_server_pod, session_id),
-        )
-    track_session_in_redis(session_id, game_server_pod, connect_host, connect_port)
-    return MatchResponse(
-        session_id=session_id,
-        players=players,
-        connect_host=connect_host,
-        connect_port=connect_port,
-    )
+@app.on_event("startup")
+async def startup() -> None:
+    try:
+        await start_pod_informer()
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to start game-server pod informer: {e}")
+    start_match_events()
+    start_warm_pool()
+    start_matchmaker()
+    start_teardown()
+    start_reconciler()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    stop_reconciler()
+    stop_matchmaker()
+    stop_teardown()
+    stop_warm_pool()
+    stop_match_events()
+    await shutdown_provisioning()
+    await stop_pod_informer()
+    await stop_node_cache()
+    await close_k8s_client()
+    await close_redis_client()
+    await close_db_pool()
 
 
 @app.get("/health")
-def health() -> dict:
+async def health() -> dict:
     try:
-        conn = get_db_conn()
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1;")
+        pool = await get_db_pool()
+        await pool.fetchval("SELECT 1;")
     except Exception:  # noqa: BLE001
         return {"status": "degraded"}
     return {"status": "ok"}
 
 
 @app.post("/match/join", response_model=MatchResponse)
-def join_match(req: MatchRequest) -> MatchResponse:
-    redis_client = get_redis_client()
-    queue_key = "matchmaking_queue"
+async def join_match(req: MatchRequest) -> MatchResponse:
+    """
+    Enqueue only; the matchmaker loop forms matches and publishes them to waiters.
+    Idempotent: a retried join keeps the player's place in the queue, and a join
+    from a player whose match is already forming returns that match.
+    """
+    redis_client = await get_redis_client()
+    bucket = queue_bucket(req.region, req.skill)
 
     if redis_client:
         try:
-            redis_client.rpush(queue_key, req.player_id)
-            redis_client.set(get_player_queue_ts_key(req.player_id), str(time.time()), ex=3600)
-            queue_len = redis_client.llen(queue_key)
-
-            flush_count = 0
-            if queue_len >= SESSION_SIZE:
-                flush_count = SESSION_SIZE
-            elif queue_len >= MIN_PARTIAL_SESSION_SIZE:
-                oldest_player = redis_client.lindex(queue_key, 0)
-                if oldest_player:
-                    queued_at_raw = redis_client.get(get_player_queue_ts_key(oldest_player))
-                    if queued_at_raw:
-                        try:
-                            oldest_wait = time.time() - float(queued_at_raw)
-                            if oldest_wait >= FLUSH_WAIT_SECONDS:
-                                flush_count = queue_len
-                        except ValueError:
-                            pass
-
-            if flush_count > 0:
-                players = dequeue_players(redis_client, queue_key, flush_count)
-                if len(players) == flush_count:
-                    return _create_match_session(players)
+            current = await lookup_player_session(redis_client, req.player_id)
+            if current and current["status"] in ("provisioning", "matched"):
+                return MatchResponse(
+                    session_id=current["session_id"],
+                    players=[req.player_id],
+                    connect_host=current.get("connect_host", ""),
+                    connect_port=current.get("connect_port", 0),
+                    status=current["status"],
+                )
+            await enqueue_player(redis_client, bucket, req.player_id)
+            return MatchResponse(session_id=f"pending:{req.player_id}", players=[req.player_id])
         except Exception as e:  # noqa: BLE001
             logger.warning(f"Redis queue operation failed: {e}, falling back to in-memory")
 
-    append_local_queue(req.player_id)
-    local_len = local_queue_len()
-    local_flush_count = 0
-    if local_len >= SESSION_SIZE:
-        local_flush_count = SESSION_SIZE
-    elif local_len >= MIN_PARTIAL_SESSION_SIZE:
-        if local_oldest_wait_seconds() >= FLUSH_WAIT_SECONDS:
-            local_flush_count = local_len
-
-    if local_flush_count > 0:
-        players = local_dequeue(local_flush_count)
-        return _create_match_session(players)
-
+    append_local_queue(bucket, req.player_id)
     return MatchResponse(session_id=f"pending:{req.player_id}", players=[req.player_id])
 
 
 @app.get("/match/status")
-def match_status(player_id: str) -> dict:
-    conn = get_db_conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT session_id, ended_at
-            FROM matches
-            WHERE
-              players_json = %s
-              OR players_json LIKE %s
-              OR players_json LIKE %s
-              OR players_json LIKE %s
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (
-                player_id,
-                f"{player_id},%",
-                f"%,{player_id},%",
-                f"%,{player_id}",
-            ),
-        )
-        row = cur.fetchone()
+async def match_status(player_id: str) -> dict:
+    redis_client = await get_redis_client()
+    if redis_client:
+        try:
+            cached = await lookup_player_session(redis_client, player_id)
+            if cached:
+                return cached
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Redis status lookup failed: {e}, falling back to Postgres")
+
+    pool = await get_db_pool()
+    row = await pool.fetchrow(
+        """
+        SELECT m.session_id, m.ended_at
+        FROM match_players mp
+        JOIN matches m ON m.session_id = mp.session_id
+        WHERE mp.player_id = $1
+        ORDER BY mp.created_at DESC
+        LIMIT 1
+        """,
+        player_id,
+    )
 
     if not row:
         return {"status": "pending"}
@@ -149,50 +137,254 @@ def match_status(player_id: str) -> dict:
     if ended_at:
         return {"status": "ended", "session_id": session_id}
 
-    redis_client = get_redis_client()
     if redis_client:
-        host = redis_client.get(f"session:{session_id}:host") or ""
-        port_str = redis_client.get(f"session:{session_id}:port") or "0"
-        port = int(port_str) if port_str.isdigit() else 0
-        if host and port:
-            return {
-                "status": "matched",
-                "session_id": session_id,
-                "connect_host": host,
-                "connect_port": port,
-            }
-    return {"status": "pending"}
+        try:
+            host, port_str = await redis_client.hmget(get_session_key(session_id), "host", "port")
+            return session_status_dict(session_id, "matched", host or "", port_str or "")
+        except Exception:  # noqa: BLE001
+            pass
+    return {"status": "provisioning", "session_id": session_id}
+
+
+WAIT_DONE_STATUSES = ("matched", "ended")
+
+
+async def _watch_status(player_id: str, deadline: float) -> AsyncIterator[dict]:
+    """Yield the player's status whenever it changes, until matched/ended or the deadline.
+
+    Woken by match events over Redis pub/sub rather than by polling; the
+    waiter is registered before each status read so no event is missed.
+    """
+    loop = asyncio.get_running_loop()
+    last = None
+    session_id = None
+    while True:
+        registered_session = session_id
+        fut = register_waiter(player_id, registered_session)
+        try:
+            status = await match_status(player_id)
+            if status != last:
+                last = status
+                yield status
+            if status["status"] in WAIT_DONE_STATUSES:
+                return
+            session_id = status.get("session_id")
+            if session_id != registered_session:
+                continue  # re-register so the session's own events wake us too
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(fut, timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+        finally:
+            unregister_waiter(fut, player_id, registered_session)
+
+
+@app.get("/match/wait")
+async def match_wait(
+    player_id: str,
+    timeout: float = Query(25.0, gt=0, le=60),
+    format: str = Query("json", pattern="^(json|sse)$"),
+):
+    """
+    Long-poll replacement for /match/status polling: returns as soon as the
+    player is matched (or the session ended), else the current status after timeout.
+    format=sse streams every status change as a Server-Sent Event instead.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    updates = _watch_status(player_id, deadline)
+    if format == "sse":
+        async def sse() -> AsyncIterator[str]:
+            async for status in updates:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    last = {"status": "pending"}
+    async for status in updates:
+        last = status
+    return last
 
 
 @app.post("/match/{session_id}/end")
-def end_match(session_id: str) -> dict:
-    try:
-        delete_game_server_pod(session_id)
-    except Exception as e:  # noqa: BLE001
-        logger.error(f"Failed to delete game server pod for {session_id}: {e}")
+async def end_match(session_id: str) -> dict:
+    """
+    Every player of a match may call this; only the first call ends the session.
+    The game server is deleted asynchronously by the teardown workers.
+    """
+    await end_sessions([session_id])
+    return {"status": "ended", "session_id": session_id}
+
 
-    conn = get_db_conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE matches SET ended_at = now() WHERE session_id = %s",
-            (session_id,),
+@app.post("/matches/end")
+async def end_matches(req: EndMatchesRequest) -> dict:
+    """End many sessions with one UPDATE and one Redis pipeline."""
+    if len(req.session_ids) > END_BATCH_MAX_SESSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {END_BATCH_MAX_SESSIONS} session_ids per request",
         )
-    untrack_session_in_redis(session_id)
-    return {"status": "ended", "session_id": session_id}
+    ended = await end_sessions(req.session_ids)
+    return {"status": "ended", "ended": ended, "requested": len(req.session_ids)}
+
+
+ACTIVE_SESSIONS_PAGE_SIZE = 500
+
+
+def _pg_session_dict(row) -> dict:
+    return {
+        "session_id": row[0],
+        "game_server_pod": row[1] or "unknown",
+        "created_at": str(row[2]) if row[2] else None,
+    }
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_pg_cursor(row) -> str:
+    # Epoch microseconds rather than isoformat: "+00:00" and "|" don't survive
+    # a client echoing next_cursor into a URL without percent-encoding.
+    micros = (row[2] - _EPOCH) // timedelta(microseconds=1)
+    return f"p:{micros}_{row[0]}"
+
+
+def _decode_pg_cursor(cursor: str) -> tuple[datetime, str]:
+    micros, sep, session_id = cursor[2:].partition("_")
+    if not sep or not session_id:
+        raise ValueError("malformed cursor")
+    return _EPOCH + timedelta(microseconds=int(micros)), session_id
+
+
+async def _pg_active_sessions_page(after: tuple[datetime, str] | None, limit: int) -> list:
+    """Keyset page over active matches, newest first, via matches_active_created_idx."""
+    pool = await get_db_pool()
+    if after is None:
+        return await pool.fetch(
+            """
+            SELECT session_id, game_server_pod, created_at
+            FROM matches
+            WHERE ended_at IS NULL
+              AND created_at > now() - interval '5 minutes'
+            ORDER BY created_at DESC, session_id DESC
+            LIMIT $1
+            """,
+            limit,
+        )
+    return await pool.fetch(
+        """
+        SELECT session_id, game_server_pod, created_at
+        FROM matches
+        WHERE ended_at IS NULL
+          AND created_at > now() - interval '5 minutes'
+          AND (created_at, session_id) < ($1, $2)
+        ORDER BY created_at DESC, session_id DESC
+        LIMIT $3
+        """,
+        after[0],
+        after[1],
+        limit,
+    )
+
+
+async def _active_sessions_page(cursor: str | None, limit: int) -> dict:
+    """
+    One page of active sessions. Cursors are opaque and URL-safe:
+    r:<sscan cursor> or p:<created_at epoch microseconds>_<session_id>.
+    """
+    if cursor is None or cursor.startswith("r:"):
+        redis_client = await get_redis_client()
+        if redis_client:
+            try:
+                scan_cursor = int(cursor[2:]) if cursor else 0
+                next_cursor, sessions = await scan_active_sessions(redis_client, scan_cursor, count=limit)
+                return {
+                    "sessions": sessions,
+                    "next_cursor": f"r:{next_cursor}" if next_cursor else None,
+                    "source": "redis",
+                }
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            except Exception as e:  # noqa: BLE001
+                if cursor is not None:
+                    raise HTTPException(status_code=503, detail=f"Redis unavailable mid-pagination: {e}")
+                logger.warning(f"Redis query failed: {e}, falling back to Postgres")
+        elif cursor is not None:
+            raise HTTPException(status_code=503, detail="Redis unavailable mid-pagination")
+    elif not cursor.startswith("p:"):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        after = _decode_pg_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = await _pg_active_sessions_page(after, limit)
+    return {
+        "sessions": [_pg_session_dict(row) for row in rows],
+        "next_cursor": _encode_pg_cursor(rows[-1]) if len(rows) == limit else None,
+        "source": "postgres",
+    }
+
+
+async def _stream_active_sessions() -> AsyncIterator[str]:
+    """NDJSON, one session per line, one page in memory at a time."""
+    redis_client = await get_redis_client()
+    if redis_client:
+        started = False
+        try:
+            cursor = 0
+            while True:
+                cursor, page = await scan_active_sessions(redis_client, cursor)
+                if page:
+                    started = True
+                    yield "".join(json.dumps(session) + "\n" for session in page)
+                if cursor == 0:
+                    return
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Redis scan failed: {e}")
+            if started:
+                return
+    after = None
+    while True:
+        rows = await _pg_active_sessions_page(after, ACTIVE_SESSIONS_PAGE_SIZE)
+        if rows:
+            yield "".join(json.dumps(_pg_session_dict(row)) + "\n" for row in rows)
+        if len(rows) < ACTIVE_SESSIONS_PAGE_SIZE:
+            return
+        after = (rows[-1][2], rows[-1][0])
 
 
 @app.get("/sessions/active")
-def get_active_sessions() -> dict:
-    redis_client = get_redis_client()
+async def get_active_sessions(
+    cursor: str | None = None,
+    limit: int = Query(0, ge=0, le=10000),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Active sessions.
+
+    - format=ndjson streams every session as one JSON object per line.
+    - cursor/limit return one page plus next_cursor (null when done).
+    - Without either, returns the whole list in one document.
+    """
+    if format == "ndjson":
+        return StreamingResponse(_stream_active_sessions(), media_type="application/x-ndjson")
+    if cursor is not None or limit:
+        return await _active_sessions_page(cursor, limit or ACTIVE_SESSIONS_PAGE_SIZE)
+
+    redis_client = await get_redis_client()
     if redis_client:
         try:
-            session_ids = redis_client.smembers("active_sessions")
             sessions = []
-            for sid in session_ids:
-                pod = redis_client.get(f"session:{sid}:pod") or "unknown"
-                sessions.append({"session_id": sid, "game_server_pod": pod})
+            cursor = 0
+            while True:
+                cursor, page = await scan_active_sessions(redis_client, cursor)
+                sessions.extend(page)
+                if cursor == 0:
+                    break
             return {
-                "count": len(session_ids),
+                "count": len(sessions),
                 "sessions": sessions,
                 "source": "redis",
                 "note": "Each session = 1 match with 12 players",
@@ -201,80 +393,34 @@ def get_active_sessions() -> dict:
             logger.warning(f"Redis query failed: {e}, falling back to Postgres")
 
     try:
-        conn = get_db_conn()
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT session_id, game_server_pod, created_at
-                FROM matches
-                WHERE ended_at IS NULL
-                  AND created_at > now() - interval '5 minutes'
-                ORDER BY created_at DESC
-                """
-            )
-            rows = cur.fetchall()
-            sessions = [
-                {
-                    "session_id": row[0],
-                    "game_server_pod": row[1] or "unknown",
-                    "created_at": str(row[2]) if row[2] else None,
-                }
-                for row in rows
-            ]
-            return {
-                "count": len(sessions),
-                "sessions": sessions,
-                "source": "postgres",
-                "note": "Each session = 1 match with 12 players (showing last 5 minutes only)",
-            }
+        pool = await get_db_pool()
+        rows = await pool.fetch(
+            """
+            SELECT session_id, game_server_pod, created_at
+            FROM matches
+            WHERE ended_at IS NULL
+              AND created_at > now() - interval '5 minutes'
+            ORDER BY created_at DESC
+            """
+        )
+        sessions = [_pg_session_dict(row) for row in rows]
+        return {
+            "count": len(sessions),
+            "sessions": sessions,
+            "source": "postgres",
+            "note": "Each session = 1 match with 12 players (showing last 5 minutes only)",
+        }
     except Exception as e:  # noqa: BLE001
         logger.error(f"Failed to query active sessions: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get active sessions: {e}")
 
 
 @app.post("/cleanup/orphaned-servers")
-def cleanup_orphaned_servers() -> dict:
-    conn = get_db_conn()
-    k8s_apps_api = get_k8s_api()
+async def cleanup_orphaned_servers() -> dict:
     try:
-        deployments = k8s_apps_api.list_namespaced_deployment(
-            namespace=NAMESPACE,
-            label_selector="app=game-server",
-        )
+        result = await reconcile_orphaned_servers()
     except Exception as e:  # noqa: BLE001
-        logger.error(f"Failed to list deployments: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to list deployments: {e}")
-
-    cleaned = 0
-    with conn.cursor() as cur:
-        for dep in deployments.items:
-            dep_name = dep.metadata.name
-            if not dep_name.startswith("game-server-"):
-                continue
-            session_prefix = dep_name.replace("game-server-", "")
-            cur.execute(
-                "SELECT ended_at FROM matches WHERE session_id LIKE %s",
-                (f"{session_prefix}%",),
-            )
-            row = cur.fetchone()
-            if row and row[0]:
-                try:
-                    core_api = get_core_v1_api()
-                    try:
-                        core_api.delete_namespaced_service(name=dep_name, namespace=NAMESPACE)
-                    except ApiException:  # noqa: BLE001
-                        pass
-                    k8s_apps_api.delete_namespaced_deployment(
-                        name=dep_name,
-                        namespace=NAMESPACE,
-                        body=client.V1DeleteOptions(propagation_policy="Foreground"),
-                    )
-                    cleaned += 1
-                    logger.info(f"Cleaned up orphaned deployment: {dep_name}")
-                except ApiException as e:
-                    if e.status != 404:
-                        logger.warning(f"Failed to delete {dep_name}: {e}")
-
-    return {"cleaned": cleaned, "message": f"Cleaned up {cleaned} orphaned game server deployments"}
-
-
+        logger.error(f"Orphaned game server reconciliation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Reconciliation failed: {e}")
+    cleaned = result["cleaned"]
+    return {**result, "message": f"Cleaned up {cleaned} orphaned game server deployments"}
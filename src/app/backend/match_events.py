@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+
+from storage import MATCH_EVENTS_CHANNEL, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# One pub/sub subscription per backend process fans session events out to the
+# local long-poll waiters, keyed by player and by session.
+_player_waiters: dict = {}  # player_id -> set of asyncio.Future
+_session_waiters: dict = {}  # session_id -> set of asyncio.Future
+_task: asyncio.Task | None = None
+
+
+def _wake(waiters: dict, key: str, event: dict) -> None:
+    for fut in waiters.get(key, ()):
+        if not fut.done():
+            fut.set_result(event)
+
+
+def _dispatch(event: dict) -> None:
+    for player_id in event.get("players") or ():
+        _wake(_player_waiters, player_id, event)
+    _wake(_session_waiters, event.get("session_id", ""), event)
+
+
+async def _run() -> None:
+    while True:
+        pubsub = None
+        try:
+            redis_client = await get_redis_client()
+            if not redis_client:
+                await asyncio.sleep(2.0)
+                continue
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(MATCH_EVENTS_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    _dispatch(json.loads(message["data"]))
+                except ValueError:
+                    logger.warning(f"Ignoring malformed match event: {message['data']!r}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Match event subscription failed: {e}, resubscribing")
+            await asyncio.sleep(1.0)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:  # noqa: BLE001
+                    pass
+
+
+def start_match_events() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+def stop_match_events() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+
+def register_waiter(player_id: str, session_id: str | None = None) -> asyncio.Future:
+    """Future resolved with the next event for player_id (or session_id, if given)."""
+    fut = asyncio.get_running_loop().create_future()
+    _player_waiters.setdefault(player_id, set()).add(fut)
+    if session_id:
+        _session_waiters.setdefault(session_id, set()).add(fut)
+    return fut
+
+
+def unregister_waiter(fut: asyncio.Future, player_id: str, session_id: str | None = None) -> None:
+    for waiters, key in ((_player_waiters, player_id), (_session_waiters, session_id)):
+        if not key:
+            continue
+        futs = waiters.get(key)
+        if futs is not None:
+            futs.discard(fut)
+            if not futs:
+                del waiters[key]
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import List
+
+from models import MatchResponse
+from provisioning import submit_provisioning
+from settings import (
+    FLUSH_WAIT_SECONDS,
+    MATCHMAKER_MAX_MATCHES_PER_SHARD,
+    MATCHMAKER_TICK_SECONDS,
+    MIN_PARTIAL_SESSION_SIZE,
+    SESSION_SIZE,
+)
+from storage import (
+    form_matches,
+    get_db_pool,
+    get_queue_key,
+    get_redis_client,
+    list_queue_buckets,
+    local_dequeue,
+    local_oldest_wait_seconds,
+    local_queue_buckets,
+    local_queue_len,
+    prune_queue_bucket,
+    requeue_local,
+    requeue_players,
+    track_session_in_redis,
+)
+from warm_pool import record_match_formed
+
+logger = logging.getLogger(__name__)
+
+_task: asyncio.Task | None = None
+
+
+def _shard_lock_key(bucket: str) -> str:
+    return f"matchmaker_lock:{{{bucket}}}"
+
+
+async def create_match_sessions(batches: List[List[str]]) -> List[MatchResponse]:
+    """Insert all matches of a pass in one transaction, then publish and provision each."""
+    session_ids = [str(uuid.uuid4()) for _ in batches]
+    backend_pod = os.getenv("HOSTNAME", "unknown")
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO matches (session_id, players_json, backend_pod)
+                SELECT unnest($1::text[]), unnest($2::text[]), $3
+                """,
+                session_ids,
+                [",".join(players) for players in batches],
+                backend_pod,
+            )
+            await conn.execute(
+                """
+                INSERT INTO match_players (player_id, session_id, created_at)
+                SELECT p.player_id, p.session_id, m.created_at
+                FROM unnest($1::text[], $2::text[]) AS p(player_id, session_id)
+                JOIN matches m ON m.session_id = p.session_id
+                """,
+                [player for players in batches for player in players],
+                [sid for sid, players in zip(session_ids, batches) for _ in players],
+            )
+
+    await asyncio.gather(
+        *(track_session_in_redis(sid, players) for sid, players in zip(session_ids, batches)),
+        *(record_match_formed(sid) for sid in session_ids),
+    )
+    for sid, players in zip(session_ids, batches):
+        submit_provisioning(sid, players)
+    return [
+        MatchResponse(session_id=sid, players=players, status="provisioning")
+        for sid, players in zip(session_ids, batches)
+    ]
+
+
+async def _claim_shard(redis_client, bucket: str) -> bool:
+    """One replica runs a given shard per tick; the lease simply expires."""
+    lease_ms = max(1, int(MATCHMAKER_TICK_SECONDS * 1000))
+    return bool(await redis_client.set(_shard_lock_key(bucket), "1", nx=True, px=lease_ms))
+
+
+async def _match_shard(redis_client, bucket: str) -> int:
+    if not await _claim_shard(redis_client, bucket):
+        return 0
+    queue_key = get_queue_key(bucket)
+    batches = await form_matches(redis_client, queue_key, MATCHMAKER_MAX_MATCHES_PER_SHARD)
+    if not batches:
+        await prune_queue_bucket(redis_client, bucket)
+        return 0
+    try:
+        await create_match_sessions([[player_id for player_id, _ in batch] for batch in batches])
+    except Exception:
+        for batch in batches:
+            await requeue_players(redis_client, queue_key, batch)
+        raise
+    return len(batches)
+
+
+def _match_local_shard(bucket: str) -> List[List[tuple]]:
+    batches: List[List[tuple]] = []
+    while local_queue_len(bucket) >= SESSION_SIZE and len(batches) < MATCHMAKER_MAX_MATCHES_PER_SHARD:
+        batches.append(local_dequeue(bucket, SESSION_SIZE))
+    remaining = local_queue_len(bucket)
+    if (
+        len(batches) < MATCHMAKER_MAX_MATCHES_PER_SHARD
+        and remaining >= max(MIN_PARTIAL_SESSION_SIZE, 1)
+        and local_oldest_wait_seconds(bucket) >= FLUSH_WAIT_SECONDS
+    ):
+        batches.append(local_dequeue(bucket, remaining))
+    return batches
+
+
+async def match_once() -> int:
+    """One matchmaking pass over every shard; returns the number of matches formed."""
+    formed = 0
+    # Players queued in memory while Redis was unavailable.
+    local_batches = [
+        (bucket, batch) for bucket in local_queue_buckets() for batch in _match_local_shard(bucket)
+    ]
+    if local_batches:
+        try:
+            await create_match_sessions(
+                [[player_id for player_id, _ in batch] for _bucket, batch in local_batches]
+            )
+            formed += len(local_batches)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to create {len(local_batches)} local match(es): {e}, requeueing")
+            for bucket, batch in reversed(local_batches):
+                requeue_local(bucket, batch)
+
+    redis_client = await get_redis_client()
+    if not redis_client:
+        return formed
+    buckets = await list_queue_buckets(redis_client)
+    results = await asyncio.gather(
+        *(_match_shard(redis_client, bucket) for bucket in buckets),
+        return_exceptions=True,
+    )
+    for bucket, result in zip(buckets, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Matchmaking failed for shard {bucket}: {result}")
+        else:
+            formed += result
+    return formed
+
+
+async def _run() -> None:
+    while True:
+        try:
+            formed = await match_once()
+            if formed:
+                logger.info(f"Matchmaker formed {formed} match(es)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Matchmaker pass failed: {e}")
+        await asyncio.sleep(MATCHMAKER_TICK_SECONDS)
+
+
+def start_matchmaker() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+def stop_matchmaker() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
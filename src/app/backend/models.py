@@ -1,10 +1,16 @@
 from typing import List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class MatchRequest(BaseModel):
     player_id: str
+    # Optional matchmaking attributes; players are only matched within the
+    # same region and skill bucket (see storage.queue_bucket).
+    # Bounded so a bad client gets a 422 instead of a 500 (NaN/inf in the
+    # bucket math) or an unbounded number of queue shards.
+    region: str | None = Field(None, max_length=32)
+    skill: float | None = Field(None, ge=-1_000_000, le=1_000_000, allow_inf_nan=False)
 
 
 class MatchResponse(BaseModel):
@@ -12,3 +18,10 @@ class MatchResponse(BaseModel):
     players: List[str]
     connect_host: str = ""
     connect_port: int = 0
+    # queued: waiting in matchmaking; provisioning: match formed, game server
+    # starting (poll /match/status for the address); matched: address ready.
+    status: str = "queued"
+
+
+class EndMatchesRequest(BaseModel):
+    session_ids: List[str]
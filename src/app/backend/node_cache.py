@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+
+from kubernetes_asyncio import watch
+
+from k8s_client import get_core_v1_api
+from settings import NODE_ADDRESS_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# node name -> (address, fetched_at). Filled by one list_node per TTL and kept
+# current by a node watch, so matches don't each pay for a full node list.
+_addresses: dict = {}
+_watch_task: asyncio.Task | None = None
+
+
+def _node_address(node) -> str:
+    for addr in (node.status.addresses if node.status else None) or []:
+        if addr.type in ("ExternalIP", "InternalIP"):
+            return addr.address
+    return ""
+
+
+async def _refresh() -> None:
+    core_api = await get_core_v1_api()
+    nodes = await core_api.list_node()
+    now = time.time()
+    _addresses.clear()
+    for node in nodes.items:
+        address = _node_address(node)
+        if address:
+            _addresses[node.metadata.name] = (address, now)
+
+
+async def _run_watch() -> None:
+    while True:
+        try:
+            core_api = await get_core_v1_api()
+            async with watch.Watch() as w:
+                async for event in w.stream(core_api.list_node, timeout_seconds=300):
+                    if event["type"] == "ERROR":
+                        break
+                    node = event["object"]
+                    address = _node_address(node) if event["type"] != "DELETED" else ""
+                    if address:
+                        _addresses[node.metadata.name] = (address, time.time())
+                    else:
+                        _addresses.pop(node.metadata.name, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Node watch failed: {e}, falling back to TTL refresh")
+            await asyncio.sleep(5.0)
+
+
+def _lookup(node_name: str | None) -> str:
+    deadline = time.time() - NODE_ADDRESS_TTL_SECONDS
+    if node_name:
+        entry = _addresses.get(node_name)
+        return entry[0] if entry and entry[1] >= deadline else ""
+    for address, fetched_at in _addresses.values():
+        if fetched_at >= deadline:
+            return address
+    return ""
+
+
+async def get_node_address(node_name: str | None = None) -> str:
+    """Address of node_name (or of any node when None), refreshing the cache on miss or expiry."""
+    global _watch_task
+    if _watch_task is None:
+        _watch_task = asyncio.create_task(_run_watch())
+    address = _lookup(node_name)
+    if not address:
+        await _refresh()
+        address = _lookup(node_name)
+    return address
+
+
+async def stop_node_cache() -> None:
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        _watch_task = None
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+
+from k8s_game_server import (
+    assign_session_to_shared_server,
+    create_shared_game_server,
+    delete_game_server_pod,
+    end_session_on_shared_server,
+    exited_shared_servers,
+    ready_shared_servers,
+    shared_server_address,
+    shared_server_capacity,
+    shared_server_id,
+    shared_server_name,
+    wait_for_game_server_ready,
+)
+from settings import SESSIONS_PER_SERVER, SHARED_SERVERS_MIN_IDLE
+from storage import get_db_pool, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# server_id -> sessions placed on it. -1 marks a server being drained.
+SHARED_LOAD_KEY = "shared_servers:load"
+
+# Take a slot on a shared server if it has one. KEYS[1] = load hash;
+# ARGV = server_id, capacity. Returns the new load, or -1 when full/draining.
+CLAIM_SLOT_SCRIPT = """
+local load = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if load < 0 or load >= tonumber(ARGV[2]) then
+  return -1
+end
+return redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+"""
+
+# KEYS[1] = load hash; ARGV = server_id
+RELEASE_SLOT_SCRIPT = """
+local load = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if load > 0 then
+  return redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+end
+return load
+"""
+
+# Mark an empty server as draining so no session can be placed on it.
+# KEYS[1] = load hash; ARGV = server_id. Returns 1 if it was empty.
+DRAIN_SCRIPT = """
+local load = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if load ~= 0 then
+  return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], -1)
+return 1
+"""
+
+_scripts: dict = {}
+# Serialises starting new shared servers within this process, so a burst of
+# matches fills one new server instead of each starting its own.
+_scale_up_lock = asyncio.Lock()
+
+
+def packing_enabled() -> bool:
+    return SESSIONS_PER_SERVER > 1
+
+
+async def _run_script(redis_client, name: str, script: str, server_id: str, *args) -> int:
+    if name not in _scripts:
+        _scripts[name] = redis_client.register_script(script)
+    return int(await _scripts[name](keys=[SHARED_LOAD_KEY], args=[server_id, *args], client=redis_client))
+
+
+async def _place_on_existing(redis_client, session_id: str) -> str | None:
+    """Best fit: try the fullest server that still has room, so servers fill before new ones start."""
+    servers = ready_shared_servers()
+    if not servers:
+        return None
+    loads = await redis_client.hmget(SHARED_LOAD_KEY, servers)
+    candidates = sorted(
+        ((int(load or 0), server_id) for server_id, load in zip(servers, loads)),
+        reverse=True,
+    )
+    for load, server_id in candidates:
+        if load < 0 or load >= SESSIONS_PER_SERVER:
+            continue
+        if await _run_script(redis_client, "claim", CLAIM_SLOT_SCRIPT, server_id, SESSIONS_PER_SERVER) < 0:
+            continue
+        result = await assign_session_to_shared_server(server_id, session_id)
+        if result == "ok":
+            return server_id
+        await _run_script(redis_client, "release", RELEASE_SLOT_SCRIPT, server_id)
+        if result == "full":
+            # Our count drifted below the server's; stop offering it until resynced.
+            await redis_client.hset(SHARED_LOAD_KEY, server_id, SESSIONS_PER_SERVER)
+    return None
+
+
+async def place_session(session_id: str) -> tuple[str, str, int] | None:
+    """
+    Host session_id on a shared multi-session server, starting one if all are
+    full. Returns (server name, connect host, connect port), or None when
+    packing is unavailable and the caller should provision a dedicated server.
+    """
+    redis_client = await get_redis_client()
+    if not redis_client:
+        return None
+    server_id = await _place_on_existing(redis_client, session_id)
+    if server_id is None:
+        async with _scale_up_lock:
+            server_id = await _place_on_existing(redis_client, session_id)
+            if server_id is None:
+                new_server = await create_shared_game_server(SESSIONS_PER_SERVER)
+                if not await wait_for_game_server_ready(new_server, timeout_seconds=45.0):
+                    logger.warning(f"Shared game server {new_server} not ready within timeout")
+                    return None
+                server_id = await _place_on_existing(redis_client, session_id)
+    if server_id is None:
+        return None
+    connect_host, connect_port = await shared_server_address(server_id)
+    logger.info(f"Session {session_id} placed on shared game server {server_id}")
+    return shared_server_name(server_id), connect_host, connect_port
+
+
+def is_shared_server(name: str | None) -> bool:
+    return shared_server_id(name) is not None
+
+
+async def release_session(session_id: str, server_name: str) -> None:
+    """End session_id on its shared server and free the slot (the server keeps running)."""
+    server_id = shared_server_id(server_name)
+    if not await end_session_on_shared_server(server_id, session_id):
+        logger.warning(f"Could not end session {session_id} on shared server {server_id}")
+    redis_client = await get_redis_client()
+    if redis_client:
+        await _run_script(redis_client, "release", RELEASE_SLOT_SCRIPT, server_id)
+
+
+async def resync_shared_loads() -> None:
+    """
+    Reset slot counts from the active matches in Postgres and each server's own
+    CAPACITY report, whichever is higher (repairs drift from lost releases).
+    """
+    redis_client = await get_redis_client()
+    if not redis_client:
+        return
+    servers = ready_shared_servers()
+    if not servers:
+        await redis_client.delete(SHARED_LOAD_KEY)
+        return
+    pool = await get_db_pool()
+    rows = await pool.fetch(
+        """
+        SELECT game_server_pod, count(*) AS sessions
+        FROM matches
+        WHERE ended_at IS NULL AND game_server_pod = ANY($1::text[])
+        GROUP BY game_server_pod
+        """,
+        [shared_server_name(server_id) for server_id in servers],
+    )
+    counts = {shared_server_id(row["game_server_pod"]): row["sessions"] for row in rows}
+    reported = await asyncio.gather(*(shared_server_capacity(server_id) for server_id in servers))
+    for server_id, capacity in zip(servers, reported):
+        if capacity is not None:
+            counts[server_id] = max(counts.get(server_id, 0), capacity[0])
+    current = await redis_client.hgetall(SHARED_LOAD_KEY)
+    pipe = redis_client.pipeline(transaction=False)
+    stale = [server_id for server_id in current if server_id not in servers]
+    if stale:
+        pipe.hdel(SHARED_LOAD_KEY, *stale)
+    for server_id in servers:
+        # Never un-drain a server or lower a count below the sessions it really hosts.
+        if int(current.get(server_id, 0)) >= 0:
+            pipe.hset(SHARED_LOAD_KEY, server_id, counts.get(server_id, 0))
+    await pipe.execute()
+
+
+async def drain_idle_shared_servers() -> int:
+    """Delete empty shared servers beyond SHARED_SERVERS_MIN_IDLE."""
+    redis_client = await get_redis_client()
+    if not redis_client:
+        return 0
+    servers = ready_shared_servers()
+    loads = await redis_client.hmget(SHARED_LOAD_KEY, servers) if servers else []
+    idle = [server_id for server_id, load in zip(servers, loads) if int(load or 0) == 0]
+    drained = 0
+    for server_id in idle[SHARED_SERVERS_MIN_IDLE:]:
+        if not await _run_script(redis_client, "drain", DRAIN_SCRIPT, server_id):
+            continue
+        try:
+            await delete_game_server_pod("", shared_server_name(server_id))
+            drained += 1
+        finally:
+            await redis_client.hdel(SHARED_LOAD_KEY, server_id)
+    return drained
+
+
+async def delete_exited_shared_servers() -> int:
+    """Delete shared servers whose process exited; the reconciler ends their sessions."""
+    redis_client = await get_redis_client()
+    deleted = 0
+    for server_id in exited_shared_servers():
+        try:
+            await delete_game_server_pod("", shared_server_name(server_id))
+            deleted += 1
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to delete exited shared game server {server_id}: {e}")
+            continue
+        if redis_client:
+            await redis_client.hdel(SHARED_LOAD_KEY, server_id)
+    return deleted
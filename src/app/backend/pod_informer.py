@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from typing import Callable, List
+
+from kubernetes_asyncio import watch
+from kubernetes_asyncio.client.rest import ApiException
+
+from k8s_client import get_core_v1_api
+from settings import NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+# One list+watch on app=game-server pods per backend process. Readiness checks
+# and warm-pool lookups read this in-memory view instead of calling the API server.
+LABEL_SELECTOR = "app=game-server"
+WATCH_TIMEOUT_SECONDS = 300
+
+_pods: dict = {}  # pod name -> V1Pod
+_session_pods: dict = {}  # session_id -> set of pod names
+_ready_sessions: set = set()
+_waiters: dict = {}  # session_id -> [asyncio.Future], resolved once the session has a ready pod
+_synced: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+_listeners: list = []  # callables(event_type, pod) run after each applied watch event
+
+
+def is_pod_ready(pod) -> bool:
+    status = pod.status
+    if pod.metadata.deletion_timestamp or status is None or status.phase != "Running":
+        return False
+    return any(cs.ready for cs in (status.container_statuses or []))
+
+
+def _session_of(pod) -> str:
+    # Shared multi-session servers carry server_id instead and are indexed under it.
+    labels = pod.metadata.labels or {}
+    return labels.get("session_id") or labels.get("server_id", "")
+
+
+def _reindex_session(session_id: str) -> None:
+    """Recompute readiness for one session and wake its waiters."""
+    if not session_id:
+        return
+    names = _session_pods.get(session_id, ())
+    if any(is_pod_ready(_pods[n]) for n in names):
+        _ready_sessions.add(session_id)
+        for waiter in _waiters.get(session_id, ()):
+            if not waiter.done():
+                waiter.set_result(True)
+    else:
+        _ready_sessions.discard(session_id)
+
+
+def _index(pod) -> None:
+    session_id = _session_of(pod)
+    if session_id:
+        _session_pods.setdefault(session_id, set()).add(pod.metadata.name)
+
+
+def _unindex(pod) -> None:
+    session_id = _session_of(pod)
+    names = _session_pods.get(session_id)
+    if names is not None:
+        names.discard(pod.metadata.name)
+        if not names:
+            del _session_pods[session_id]
+
+
+def _apply(event_type: str, pod) -> None:
+    name = pod.metadata.name
+    previous = _pods.pop(name, None)
+    if previous is not None:
+        _unindex(previous)
+    if event_type != "DELETED":
+        _pods[name] = pod
+        _index(pod)
+    if previous is not None and _session_of(previous) != _session_of(pod):
+        _reindex_session(_session_of(previous))
+    _reindex_session(_session_of(pod))
+    for listener in _listeners:
+        try:
+            listener(event_type, pod)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Pod listener failed: {e}")
+
+
+async def _relist() -> str:
+    core_api = await get_core_v1_api()
+    pods = await core_api.list_namespaced_pod(namespace=NAMESPACE, label_selector=LABEL_SELECTOR)
+    _pods.clear()
+    _session_pods.clear()
+    for pod in pods.items:
+        _pods[pod.metadata.name] = pod
+        _index(pod)
+    _ready_sessions.clear()
+    for session_id in set(_session_pods) | set(_waiters):
+        _reindex_session(session_id)
+    _synced.set()
+    return pods.metadata.resource_version
+
+
+async def _run() -> None:
+    resource_version = None
+    while True:
+        try:
+            if resource_version is None:
+                resource_version = await _relist()
+            core_api = await get_core_v1_api()
+            async with watch.Watch() as w:
+                async for event in w.stream(
+                    core_api.list_namespaced_pod,
+                    namespace=NAMESPACE,
+                    label_selector=LABEL_SELECTOR,
+                    resource_version=resource_version,
+                    timeout_seconds=WATCH_TIMEOUT_SECONDS,
+                ):
+                    if event["type"] == "ERROR":
+                        # Usually 410 Gone: our resourceVersion is too old, start over.
+                        resource_version = None
+                        break
+                    pod = event["object"]
+                    resource_version = pod.metadata.resource_version
+                    _apply(event["type"], pod)
+        except asyncio.CancelledError:
+            raise
+        except ApiException as e:
+            resource_version = None
+            if e.status != 410:
+                logger.warning(f"Pod watch failed: {e}, relisting")
+                await asyncio.sleep(1.0)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Pod watch failed: {e}, relisting")
+            resource_version = None
+            await asyncio.sleep(1.0)
+
+
+async def start_pod_informer(sync_timeout: float = 5.0) -> None:
+    global _task, _synced
+    if _task is None:
+        _synced = asyncio.Event()
+        _task = asyncio.create_task(_run())
+    try:
+        await asyncio.wait_for(_synced.wait(), timeout=sync_timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Pod informer has not synced yet; readiness waits will rely on watch events")
+
+
+async def stop_pod_informer() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+
+def add_pod_listener(listener: Callable) -> None:
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_pod_listener(listener: Callable) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def is_synced() -> bool:
+    return _synced is not None and _synced.is_set()
+
+
+def is_session_ready(session_id: str) -> bool:
+    return session_id in _ready_sessions
+
+
+async def wait_for_session_ready(session_id: str, timeout_seconds: float) -> bool:
+    """Wait until a ready pod labelled session_id is seen, woken by watch events."""
+    if session_id in _ready_sessions:
+        return True
+    waiter = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(session_id, []).append(waiter)
+    try:
+        return await asyncio.wait_for(waiter, timeout=timeout_seconds)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        waiters = _waiters.get(session_id, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            _waiters.pop(session_id, None)
+
+
+def list_pods(predicate: Callable) -> List:
+    return [pod for pod in _pods.values() if predicate(pod)]
+
+
+def sessions_with_pods() -> set:
+    return set(_session_pods)
+
+
+def session_pods(session_id: str) -> List:
+    return [_pods[n] for n in _session_pods.get(session_id, ())]
+
+
+def game_server_exited(pod) -> bool:
+    """The game server process has exited at least once (match over or crashed)."""
+    status = pod.status
+    if status is None:
+        return False
+    if status.phase in ("Succeeded", "Failed"):
+        return True
+    for cs in status.container_statuses or []:
+        if cs.restart_count or (cs.state and cs.state.terminated):
+            return True
+    return False
+
+
+def session_node_name(session_id: str) -> str | None:
+    """Node a session's game-server pod was scheduled on, if known."""
+    pods = [_pods[n] for n in _session_pods.get(session_id, ())]
+    for pod in sorted(pods, key=is_pod_ready, reverse=True):
+        if pod.spec and pod.spec.node_name:
+            return pod.spec.node_name
+    return None
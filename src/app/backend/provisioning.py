@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import List
+
+from k8s_game_server import claim_warm_game_server, create_game_server_pod, delete_game_server_pod
+from packing import is_shared_server, packing_enabled, place_session, release_session
+from settings import PROVISION_WORKERS, WARM_POOL_ENABLED
+from storage import get_db_pool, track_session_in_redis, untrack_session_in_redis
+
+logger = logging.getLogger(__name__)
+
+_semaphore: asyncio.Semaphore | None = None
+_tasks: set = set()
+
+
+async def _provision_session(session_id: str, players: List[str]) -> None:
+    """Create the game server for a formed match and publish its address to Redis."""
+    try:
+        claimed = await place_session(session_id) if packing_enabled() else None
+        if claimed is None and WARM_POOL_ENABLED:
+            claimed = await claim_warm_game_server(session_id)
+        if claimed is None:
+            claimed = await create_game_server_pod(session_id, players)
+        game_server_pod, connect_host, connect_port = claimed
+    except Exception as e:  # noqa: BLE001
+        logger.error(f"Provisioning failed for session {session_id}: {e}")
+        try:
+            pool = await get_db_pool()
+            await pool.execute("UPDATE matches SET ended_at = now() WHERE session_id = $1", session_id)
+        except Exception as db_err:  # noqa: BLE001
+            logger.error(f"Failed to mark session {session_id} as ended: {db_err}")
+        await untrack_session_in_redis(session_id)
+        return
+
+    pool = await get_db_pool()
+    updated = await pool.fetchval(
+        """
+        UPDATE matches SET game_server_pod = $1
+        WHERE session_id = $2 AND ended_at IS NULL
+        RETURNING session_id
+        """,
+        game_server_pod,
+        session_id,
+    )
+    if updated is None:
+        # Ended while provisioning: don't resurrect it in Redis, and give the server back.
+        logger.info(f"Session {session_id} ended during provisioning, releasing {game_server_pod}")
+        if is_shared_server(game_server_pod):
+            await release_session(session_id, game_server_pod)
+        else:
+            await delete_game_server_pod(session_id, game_server_pod)
+        return
+    await track_session_in_redis(session_id, players, game_server_pod, connect_host, connect_port)
+    logger.info(f"Session {session_id} ready at {connect_host}:{connect_port}")
+
+
+async def _run_limited(session_id: str, players: List[str]) -> None:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(PROVISION_WORKERS)
+    async with _semaphore:
+        try:
+            await _provision_session(session_id, players)
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"Provisioning task for session {session_id} crashed: {e}")
+
+
+def submit_provisioning(session_id: str, players: List[str]) -> None:
+    """Queue game-server provisioning for session_id without blocking the caller."""
+    task = asyncio.get_running_loop().create_task(_run_limited(session_id, players))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def shutdown_provisioning() -> None:
+    for task in list(_tasks):
+        task.cancel()
+    _tasks.clear()
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import os
+import time
+
+from k8s_game_server import (
+    SHARED_SERVER_ID_PREFIX,
+    delete_game_server_pod,
+    get_k8s_api,
+    shared_server_id,
+    shared_server_name,
+)
+from packing import delete_exited_shared_servers, drain_idle_shared_servers, resync_shared_loads
+from pod_informer import (
+    add_pod_listener,
+    game_server_exited,
+    is_synced,
+    list_pods,
+    remove_pod_listener,
+    session_pods,
+    sessions_with_pods,
+)
+from settings import (
+    GAME_SERVER_MODE,
+    NAMESPACE,
+    PROVISION_TIMEOUT_SECONDS,
+    RECONCILE_ACTIONS_PER_SECOND,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_ENABLED,
+    RECONCILE_INTERVAL_SECONDS,
+)
+from storage import get_db_pool, get_redis_client
+from teardown import end_sessions
+
+logger = logging.getLogger(__name__)
+
+LIST_PAGE_SIZE = 500
+LEADER_KEY = "reconciler:leader"
+# A session with a recorded game server but no pod is only treated as lost
+# after this long, so pods that are still being scheduled are not mistaken for it.
+MISSING_SERVER_GRACE_SECONDS = 60
+
+_task: asyncio.Task | None = None
+_wakeup: asyncio.Event | None = None
+_dirty_sessions: set = set()
+_next_action_at = 0.0
+_leader_id = os.getenv("HOSTNAME", "unknown")
+
+
+async def list_session_deployments() -> dict:
+    """session_id -> deployment (or bare pod) name for every game server bound to a session."""
+    if GAME_SERVER_MODE == "pod":
+        # Bare pods are already mirrored by the pod informer; no LIST needed.
+        return {
+            pod.metadata.labels["session_id"]: pod.metadata.name
+            for pod in list_pods(lambda pod: bool((pod.metadata.labels or {}).get("session_id")))
+        }
+    k8s_apps_api = await get_k8s_api()
+    by_session: dict = {}
+    continue_token = None
+    while True:
+        kwargs = {"_continue": continue_token} if continue_token else {}
+        page = await k8s_apps_api.list_namespaced_deployment(
+            namespace=NAMESPACE,
+            label_selector="app=game-server,session_id",
+            limit=LIST_PAGE_SIZE,
+            **kwargs,
+        )
+        for dep in page.items:
+            by_session[dep.metadata.labels["session_id"]] = dep.metadata.name
+        continue_token = page.metadata._continue
+        if not continue_token:
+            return by_session
+
+
+async def ended_sessions(session_ids: list) -> set:
+    """Which of session_ids have ended, in one primary-key lookup."""
+    if not session_ids:
+        return set()
+    pool = await get_db_pool()
+    rows = await pool.fetch(
+        "SELECT session_id FROM matches WHERE session_id = ANY($1::text[]) AND ended_at IS NOT NULL",
+        session_ids,
+    )
+    return {row["session_id"] for row in rows}
+
+
+async def _rate_limit() -> None:
+    """Space reconciler actions at RECONCILE_ACTIONS_PER_SECOND across all workers."""
+    global _next_action_at
+    now = time.monotonic()
+    wait = _next_action_at - now
+    _next_action_at = max(now, _next_action_at) + 1.0 / RECONCILE_ACTIONS_PER_SECOND
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def _delete_all(targets: dict) -> int:
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+    async def delete(session_id: str, name: str) -> bool:
+        async with semaphore:
+            await _rate_limit()
+            try:
+                await delete_game_server_pod(session_id, name)
+                return True
+            except Exception as e:  # noqa: BLE001
+                logger.warning(f"Failed to delete orphaned deployment {name}: {e}")
+                return False
+
+    results = await asyncio.gather(*(delete(sid, name) for sid, name in targets.items()))
+    return sum(results)
+
+
+async def reconcile_orphaned_servers() -> dict:
+    """Delete game servers whose match has ended: one LIST, one query, parallel deletes."""
+    by_session = await list_session_deployments()
+    ended = await ended_sessions(list(by_session))
+    orphans = {sid: by_session[sid] for sid in ended}
+    cleaned = await _delete_all(orphans)
+    if orphans:
+        logger.info(f"Reconciled {cleaned}/{len(orphans)} orphaned game servers out of {len(by_session)}")
+    return {"checked": len(by_session), "orphaned": len(orphans), "cleaned": cleaned}
+
+
+async def sessions_on_shared_servers(server_ids: list) -> list:
+    """Active matches hosted on the given shared (multi-session) servers."""
+    if not server_ids:
+        return []
+    pool = await get_db_pool()
+    rows = await pool.fetch(
+        "SELECT session_id FROM matches WHERE ended_at IS NULL AND game_server_pod = ANY($1::text[])",
+        [shared_server_name(server_id) for server_id in server_ids],
+    )
+    return [row["session_id"] for row in rows]
+
+
+async def _expand_shared(ids: list) -> list:
+    """Replace shared server ids with the sessions they host."""
+    shared = [i for i in ids if i.startswith(SHARED_SERVER_ID_PREFIX)]
+    sessions = [i for i in ids if i not in shared]
+    return sessions + await sessions_on_shared_servers(shared)
+
+
+async def lost_sessions() -> list:
+    """Active matches whose game server has exited, whose pod is gone, or that never got one."""
+    with_pods = sessions_with_pods()
+    exited = [
+        sid for sid in with_pods
+        if any(game_server_exited(pod) for pod in session_pods(sid))
+    ]
+    pool = await get_db_pool()
+    rows = await pool.fetch(
+        """
+        SELECT session_id, game_server_pod FROM matches
+        WHERE ended_at IS NULL
+          AND (
+            (game_server_pod IS NOT NULL AND created_at < now() - make_interval(secs => $1))
+            OR (game_server_pod IS NULL AND created_at < now() - make_interval(secs => $2))
+          )
+        """,
+        float(MISSING_SERVER_GRACE_SECONDS),
+        float(PROVISION_TIMEOUT_SECONDS),
+    )
+    # Pods of shared servers are keyed by server_id, not by the sessions they host.
+    missing = [
+        row["session_id"] for row in rows
+        if row["game_server_pod"] is not None
+        and (shared_server_id(row["game_server_pod"]) or row["session_id"]) not in with_pods
+    ]
+    stuck = [row["session_id"] for row in rows if row["game_server_pod"] is None]
+    return await _expand_shared(exited) + missing + stuck
+
+
+async def _end_lost_sessions(session_ids: list) -> int:
+    """End sessions (DB, Redis, teardown queue) in rate-limited batches."""
+    ended = 0
+    batch_size = max(1, int(RECONCILE_ACTIONS_PER_SECOND))
+    for i in range(0, len(session_ids), batch_size):
+        await _rate_limit()
+        ended += len(await end_sessions(session_ids[i:i + batch_size]))
+    return ended
+
+
+async def _acquire_leadership() -> bool:
+    """One backend replica reconciles at a time; the lease is renewed every pass."""
+    redis_client = await get_redis_client()
+    if not redis_client:
+        return True
+    ttl = max(1, int(RECONCILE_INTERVAL_SECONDS * 3))
+    try:
+        if await redis_client.set(LEADER_KEY, _leader_id, nx=True, ex=ttl):
+            return True
+        if await redis_client.get(LEADER_KEY) == _leader_id:
+            await redis_client.expire(LEADER_KEY, ttl)
+            return True
+        return False
+    except Exception:  # noqa: BLE001
+        return True
+
+
+def _on_pod_event(event_type: str, pod) -> None:
+    labels = pod.metadata.labels or {}
+    session_id = labels.get("session_id") or labels.get("server_id")
+    if session_id and event_type != "DELETED" and game_server_exited(pod):
+        _dirty_sessions.add(session_id)
+        if _wakeup is not None:
+            _wakeup.set()
+
+
+async def reconcile_once(full: bool) -> None:
+    if not await _acquire_leadership():
+        _dirty_sessions.clear()
+        return
+    if full:
+        _dirty_sessions.clear()
+        if is_synced():
+            lost = await lost_sessions()
+            if lost:
+                ended = await _end_lost_sessions(lost)
+                logger.info(f"Ended {ended} session(s) whose game server exited, disappeared or never started")
+        await reconcile_orphaned_servers()
+        if is_synced():
+            deleted = await delete_exited_shared_servers()
+            if deleted:
+                logger.info(f"Deleted {deleted} exited shared game server(s)")
+            await resync_shared_loads()
+            drained = await drain_idle_shared_servers()
+            if drained:
+                logger.info(f"Drained {drained} idle shared game server(s)")
+    elif _dirty_sessions:
+        dirty = list(_dirty_sessions)
+        _dirty_sessions.clear()
+        ended = await _end_lost_sessions(await _expand_shared(dirty))
+        if ended:
+            logger.info(f"Ended {ended} session(s) whose game server exited")
+
+
+async def _run() -> None:
+    next_full = 0.0
+    while True:
+        timeout = max(0.0, next_full - time.monotonic())
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        full = time.monotonic() >= next_full
+        try:
+            await reconcile_once(full)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Reconcile pass failed: {e}")
+        if full:
+            next_full = time.monotonic() + RECONCILE_INTERVAL_SECONDS
+
+
+def start_reconciler() -> None:
+    """Event-driven reconciliation (pod watch) plus a full pass every RECONCILE_INTERVAL_SECONDS."""
+    global _task, _wakeup
+    if not RECONCILE_ENABLED or _task is not None:
+        return
+    _wakeup = asyncio.Event()
+    add_pod_listener(_on_pod_event)
+    _task = asyncio.get_running_loop().create_task(_run())
+
+
+def stop_reconciler() -> None:
+    global _task
+    remove_pod_listener(_on_pod_event)
+    if _task is not None:
+        _task.cancel()
+        _task = None
@@ -1,41 +1,82 @@
-from collections import deque
+from collections import OrderedDict
+import asyncio
+import json
 import logging
-import os
+import re
 import time
 from typing import List
 
-import psycopg2
-import redis
+import asyncpg
+import redis.asyncio as redis
 
-from settings import DATABASE_URL, REDIS_HOST, REDIS_PORT
+from settings import (
+    DATABASE_URL,
+    DB_POOL_HEALTHCHECK_SECONDS,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DEFAULT_REGION,
+    FLUSH_WAIT_SECONDS,
+    GAME_SERVER_HOST_PORT_MAX,
+    GAME_SERVER_HOST_PORT_MIN,
+    MIN_PARTIAL_SESSION_SIZE,
+    REDIS_HOST,
+    REDIS_PORT,
+    SESSION_SIZE,
+    SKILL_BUCKET_WIDTH,
+)
 
 logger = logging.getLogger(__name__)
 
-_db_conn = None
+_db_pool: asyncpg.Pool | None = None
+_db_pool_lock = asyncio.Lock()
 _redis_client = None
-_local_queue = deque()
+# bucket -> OrderedDict of player_id -> queued_at in join order; used only
+# while Redis is unavailable.
+_local_queues: dict = {}
 
 
-def get_db_conn():
-    global _db_conn
-    if _db_conn is None:
-        _db_conn = psycopg2.connect(DATABASE_URL)
-        _db_conn.autocommit = True
-        ensure_schema(_db_conn)
-    return _db_conn
+async def get_db_pool() -> asyncpg.Pool:
+    """Shared asyncpg pool; acquiring waits while all DB_POOL_MAX_SIZE connections are busy.
 
+    asyncpg drops connections that fail with a connection-level error and opens
+    fresh ones on demand, so the pool heals after a Postgres restart.
+    """
+    global _db_pool
+    if _db_pool is None:
+        async with _db_pool_lock:
+            if _db_pool is None:
+                pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_HEALTHCHECK_SECONDS,
+                    timeout=5,
+                )
+                async with pool.acquire() as conn:
+                    await ensure_schema(conn)
+                _db_pool = pool
+    return _db_pool
 
-def get_redis_client():
+
+async def close_db_pool() -> None:
+    global _db_pool
+    if _db_pool is not None:
+        await _db_pool.close()
+        _db_pool = None
+
+
+async def get_redis_client():
     global _redis_client
     if _redis_client is None:
         try:
-            _redis_client = redis.Redis(
+            client = redis.Redis(
                 host=REDIS_HOST,
                 port=REDIS_PORT,
                 decode_responses=True,
                 socket_connect_timeout=2,
             )
-            _redis_client.ping()
+            await client.ping()
+            _redis_client = client
             logger.info(f"Connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
         except Exception as e:  # noqa: BLE001
             logger.warning(f"Redis connection failed: {e}, continuing without Redis")
@@ -43,104 +84,471 @@ def get_redis_client():
     return _redis_client
 
 
-def ensure_schema(conn) -> None:
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS matches (
-              session_id text PRIMARY KEY,
-              players_json text NOT NULL,
-              backend_pod text,
-              created_at timestamptz DEFAULT now()
-            );
-            """
-        )
-        cur.execute(
-            """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name='matches' AND column_name='game_server_pod';
-            """
-        )
-        if not cur.fetchone():
-            cur.execute("ALTER TABLE matches ADD COLUMN game_server_pod text;")
+async def close_redis_client() -> None:
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
 
-        cur.execute(
+
+async def ensure_schema(conn) -> None:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS matches (
+          session_id text PRIMARY KEY,
+          players_json text NOT NULL,
+          backend_pod text,
+          created_at timestamptz DEFAULT now()
+        );
+        """
+    )
+    has_column = await conn.fetchval(
+        """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name='matches' AND column_name='game_server_pod';
+        """
+    )
+    if not has_column:
+        await conn.execute("ALTER TABLE matches ADD COLUMN game_server_pod text;")
+
+    has_column = await conn.fetchval(
+        """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name='matches' AND column_name='ended_at';
+        """
+    )
+    if not has_column:
+        await conn.execute("ALTER TABLE matches ADD COLUMN ended_at timestamptz;")
+
+    # One row per (player, match) so /match/status is an index seek instead
+    # of LIKE scans over matches.players_json.
+    has_match_players = await conn.fetchval("SELECT to_regclass('public.match_players') IS NOT NULL;")
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS match_players (
+          player_id text NOT NULL,
+          session_id text NOT NULL REFERENCES matches(session_id) ON DELETE CASCADE,
+          created_at timestamptz DEFAULT now(),
+          PRIMARY KEY (session_id, player_id)
+        );
+        """
+    )
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS match_players_player_created_idx
+        ON match_players (player_id, created_at DESC);
+        """
+    )
+    # Keyset pagination over active matches for /sessions/active.
+    await conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS matches_active_created_idx
+        ON matches (created_at DESC, session_id DESC)
+        WHERE ended_at IS NULL;
+        """
+    )
+    if not has_match_players:
+        result = await conn.execute(
             """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name='matches' AND column_name='ended_at';
+            INSERT INTO match_players (player_id, session_id, created_at)
+            SELECT unnest(string_to_array(players_json, ',')), session_id, created_at
+            FROM matches
+            ON CONFLICT DO NOTHING;
             """
         )
-        if not cur.fetchone():
-            cur.execute("ALTER TABLE matches ADD COLUMN ended_at timestamptz;")
+        logger.info(f"Backfilled match_players: {result}")
+
+
+SESSION_TTL_SECONDS = 3600
+# Pub/sub channel carrying session status changes (see match_events.py).
+MATCH_EVENTS_CHANNEL = "match_events"
+
+
+def _match_event(session_id: str, status: str, players: List[str], host: str = "", port: int = 0) -> str:
+    event = {"session_id": session_id, "status": status, "players": players}
+    if status == "matched":
+        event["connect_host"] = host
+        event["connect_port"] = port
+    return json.dumps(event)
+
+
+def get_session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
 
+def get_player_session_key(player_id: str) -> str:
+    return f"player:{player_id}:session"
 
-def track_session_in_redis(session_id: str, game_server_pod: str, connect_host: str, connect_port: int) -> None:
-    redis_client = get_redis_client()
+
+async def track_session_in_redis(
+    session_id: str,
+    players: List[str],
+    game_server_pod: str = "",
+    connect_host: str = "",
+    connect_port: int = 0,
+) -> None:
+    """Publish a session and its player index so /match/status can be answered from Redis.
+
+    Called once when the match forms (no address yet, status=provisioning) and
+    again when the game server is ready.
+    """
+    redis_client = await get_redis_client()
     if not redis_client:
         return
+    session_key = get_session_key(session_id)
+    status = "matched" if connect_host and connect_port else "provisioning"
     try:
-        redis_client.sadd("active_sessions", session_id)
-        redis_client.set(f"session:{session_id}:pod", game_server_pod, ex=3600)
-        redis_client.set(f"session:{session_id}:host", connect_host, ex=3600)
-        redis_client.set(f"session:{session_id}:port", str(connect_port), ex=3600)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sadd("active_sessions", session_id)
+        pipe.hset(
+            session_key,
+            mapping={
+                "status": status,
+                "pod": game_server_pod,
+                "host": connect_host,
+                "port": str(connect_port),
+            },
+        )
+        pipe.expire(session_key, SESSION_TTL_SECONDS)
+        for player_id in players:
+            pipe.set(get_player_session_key(player_id), session_id, ex=SESSION_TTL_SECONDS)
+        pipe.publish(
+            MATCH_EVENTS_CHANNEL,
+            _match_event(session_id, status, players, connect_host, connect_port),
+        )
+        await pipe.execute()
     except Exception:  # noqa: BLE001
         pass
 
 
-def untrack_session_in_redis(session_id: str) -> None:
-    redis_client = get_redis_client()
+async def untrack_session_in_redis(session_id: str) -> None:
+    await untrack_sessions_in_redis([session_id])
+
+
+async def untrack_sessions_in_redis(session_ids: List[str]) -> None:
+    """Remove ended sessions from active_sessions and publish "ended", all in one pipeline."""
+    redis_client = await get_redis_client()
+    if not redis_client or not session_ids:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.srem("active_sessions", *session_ids)
+        for session_id in session_ids:
+            session_key = get_session_key(session_id)
+            # Keep a short-lived tombstone so status polls for this match stay in Redis.
+            pipe.hset(session_key, mapping={"status": "ended", "host": "", "port": "0"})
+            pipe.expire(session_key, 300)
+            pipe.publish(MATCH_EVENTS_CHANNEL, _match_event(session_id, "ended", []))
+        await pipe.execute()
+        logger.info(f"Removed {len(session_ids)} ended session(s) from Redis")
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to remove sessions from Redis: {e}")
+
+
+END_CLAIM_TTL_SECONDS = 300
+
+
+async def claim_session_ends(session_ids: List[str]) -> List[str]:
+    """
+    Deduplicate end requests across clients and replicas: returns the subset of
+    session_ids this call is the first to end. Without Redis every id is returned
+    and the ended_at IS NULL guard in end_sessions does the deduplication.
+    """
+    redis_client = await get_redis_client()
     if not redis_client:
+        return list(session_ids)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.set(f"{get_session_key(session_id)}:ending", "1", nx=True, ex=END_CLAIM_TTL_SECONDS)
+        claimed = await pipe.execute()
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"Failed to claim session ends in Redis: {e}")
+        return list(session_ids)
+    return [sid for sid, ok in zip(session_ids, claimed) if ok]
+
+
+async def release_session_ends(session_ids: List[str]) -> None:
+    """Drop end claims after a failed end so a retry is not deduplicated away."""
+    redis_client = await get_redis_client()
+    if not redis_client or not session_ids:
         return
     try:
-        redis_client.srem("active_sessions", session_id)
-        redis_client.delete(f"session:{session_id}:pod")
-        redis_client.delete(f"session:{session_id}:host")
-        redis_client.delete(f"session:{session_id}:port")
-        logger.info(f"Removed active session {session_id} from Redis")
+        await redis_client.delete(*(f"{get_session_key(sid)}:ending" for sid in session_ids))
     except Exception as e:  # noqa: BLE001
-        logger.warning(f"Failed to remove session from Redis: {e}")
+        logger.warning(f"Failed to release session end claims: {e}")
 
 
-def get_player_queue_ts_key(player_id: str) -> str:
-    return f"matchmaking:queued_at:{player_id}"
+HOST_PORT_SEQ_KEY = "game_server:host_port_seq"
+_local_host_port_seq = 0
 
 
-def dequeue_players(redis_client, queue_key: str, count: int) -> List[str]:
-    pipe = redis_client.pipeline()
-    for _ in range(count):
-        pipe.lpop(queue_key)
-    players_list = pipe.execute()
-    players = [p for p in players_list if p]
-    if players:
+async def allocate_host_port() -> int:
+    """Next hostPort in GAME_SERVER_HOST_PORT_MIN..MAX, round-robin across all replicas."""
+    global _local_host_port_seq
+    span = GAME_SERVER_HOST_PORT_MAX - GAME_SERVER_HOST_PORT_MIN + 1
+    seq = None
+    redis_client = await get_redis_client()
+    if redis_client:
         try:
-            cleanup = redis_client.pipeline()
-            for p in players:
-                cleanup.delete(get_player_queue_ts_key(p))
-            cleanup.execute()
-        except Exception:  # noqa: BLE001
-            pass
-    return players
+            seq = await redis_client.incr(HOST_PORT_SEQ_KEY)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to allocate host port from Redis: {e}")
+    if seq is None:
+        _local_host_port_seq += 1
+        seq = _local_host_port_seq
+    return GAME_SERVER_HOST_PORT_MIN + (seq % span)
+
+
+ACTIVE_SESSIONS_SCAN_COUNT = 1000
+
+
+async def scan_active_sessions(redis_client, cursor: int = 0, count: int = ACTIVE_SESSIONS_SCAN_COUNT):
+    """One SSCAN page of active_sessions joined with each session hash in a single pipeline.
+
+    Returns (next_cursor, [session dict]); next_cursor is 0 once the scan is complete.
+    """
+    cursor, session_ids = await redis_client.sscan("active_sessions", cursor=cursor, count=count)
+    if not session_ids:
+        return cursor, []
+    pipe = redis_client.pipeline(transaction=False)
+    for sid in session_ids:
+        pipe.hgetall(get_session_key(sid))
+    fields = await pipe.execute()
+    sessions = [
+        {
+            "session_id": sid,
+            "game_server_pod": data.get("pod") or "unknown",
+            "status": data.get("status") or "unknown",
+        }
+        for sid, data in zip(session_ids, fields)
+    ]
+    return cursor, sessions
+
+
+# Resolve player -> session -> address in a single round trip.
+# The session key is derived inside the script, so this assumes a
+# non-clustered Redis (as deployed in src/databases/redis.yaml).
+# KEYS[1] = player:{id}:session
+PLAYER_SESSION_SCRIPT = """
+local session_id = redis.call('GET', KEYS[1])
+if not session_id then
+  return nil
+end
+local fields = redis.call('HMGET', 'session:' .. session_id, 'status', 'host', 'port')
+return {session_id, fields[1] or '', fields[2] or '', fields[3] or ''}
+"""
+
+_player_session_script = None
+# Value of player:{id}:session while the player waits in a queue.
+QUEUED_MARKER = "-"
+
+
+async def lookup_player_session(redis_client, player_id: str) -> dict | None:
+    """Status dict for player_id from Redis alone, or None on a cache miss."""
+    global _player_session_script
+    if _player_session_script is None:
+        _player_session_script = redis_client.register_script(PLAYER_SESSION_SCRIPT)
+    result = await _player_session_script(keys=[get_player_session_key(player_id)], client=redis_client)
+    if not result:
+        return None
+    session_id, status, host, port_str = result
+    if session_id == QUEUED_MARKER:
+        return {"status": "pending"}
+    if not status:
+        return None
+    return session_status_dict(session_id, status, host, port_str)
+
+
+def session_status_dict(session_id: str, status: str, host: str, port_str: str) -> dict:
+    port = int(port_str) if port_str and port_str.isdigit() else 0
+    if status == "ended":
+        return {"status": "ended", "session_id": session_id}
+    if host and port:
+        return {
+            "status": "matched",
+            "session_id": session_id,
+            "connect_host": host,
+            "connect_port": port,
+        }
+    return {"status": "provisioning", "session_id": session_id}
+
+
+# Each shard's queue is a sorted set of player_id scored by join time, so a
+# repeated join (client retry) is a no-op that keeps the original position,
+# and the oldest waiting player is a ZRANGE 0 0 lookup.
+
+# Add a player unless already queued. KEYS[1] = queue zset; ARGV = player_id, now.
+# Returns {added (0/1), queue length}.
+ENQUEUE_SCRIPT = """
+local added = redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1])
+return {added, redis.call('ZCARD', KEYS[1])}
+"""
+
+# Pop every match that can form in one shard right now: as many full batches
+# of session_size as the queue holds (up to max_matches), then one partial
+# batch of the remainder once its oldest player has waited flush_wait seconds.
+# Atomic, so matchers on several replicas never pop overlapping batches.
+# Each batch is returned as ZPOPMIN's flat {player_id, queued_at, ...} list.
+# KEYS[1] = queue zset
+# ARGV = now, session_size, min_partial_session_size, flush_wait_seconds, max_matches
+FORM_MATCHES_SCRIPT = """
+local queue_key = KEYS[1]
+local now = tonumber(ARGV[1])
+local session_size = tonumber(ARGV[2])
+local min_partial = tonumber(ARGV[3])
+local flush_wait = tonumber(ARGV[4])
+local max_matches = tonumber(ARGV[5])
+
+local batches = {}
+local queue_len = redis.call('ZCARD', queue_key)
+while queue_len >= session_size and #batches < max_matches do
+  table.insert(batches, redis.call('ZPOPMIN', queue_key, session_size))
+  queue_len = queue_len - session_size
+end
+
+if #batches < max_matches and queue_len >= min_partial and queue_len > 0 then
+  local oldest = redis.call('ZRANGE', queue_key, 0, 0, 'WITHSCORES')
+  if oldest[2] and now - tonumber(oldest[2]) >= flush_wait then
+    table.insert(batches, redis.call('ZPOPMIN', queue_key, queue_len))
+  end
+end
+return batches
+"""
+
+_enqueue_script = None
+_form_matches_script = None
+
+# Buckets with a queue, scored by their last enqueue time, for matchers that
+# walk all shards. Refreshed on every join (so a flushed or lost key is rebuilt
+# by the next join) and pruned once a bucket's queue is empty and idle.
+QUEUE_BUCKETS_KEY = "matchmaking_shards"
+QUEUE_BUCKET_IDLE_SECONDS = 60
+_BUCKET_UNSAFE = re.compile(r"[^a-z0-9_-]")
+
+# Drop an idle bucket unless a join refreshed it meanwhile.
+# KEYS[1] = bucket registry zset; ARGV = bucket, cutoff.
+PRUNE_BUCKET_SCRIPT = """
+local last = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if last and tonumber(last) < tonumber(ARGV[2]) then
+  return redis.call('ZREM', KEYS[1], ARGV[1])
+end
+return 0
+"""
+_prune_bucket_script = None
+
+
+def queue_bucket(region: str | None, skill: float | None) -> str:
+    """Shard id for a join, e.g. "eu-west:6" (skill 1500-1749 at width 250) or "global:any"."""
+    region = _BUCKET_UNSAFE.sub("", (region or "").lower()) or DEFAULT_REGION
+    skill_bucket = "any" if skill is None else str(int(skill // SKILL_BUCKET_WIDTH))
+    return f"{region}:{skill_bucket}"
+
+
+def get_queue_key(bucket: str) -> str:
+    # The {bucket} hash tag pins each shard (and its matchmaker lease) to one
+    # Redis Cluster slot while spreading different shards across slots.
+    return f"matchmaking:{{{bucket}}}:queue"
+
+
+async def list_queue_buckets(redis_client) -> List[str]:
+    return await redis_client.zrange(QUEUE_BUCKETS_KEY, 0, -1)
+
+
+async def enqueue_player(redis_client, bucket: str, player_id: str) -> tuple[bool, int]:
+    """Queue player_id in bucket if not already queued; returns (added, queue length)."""
+    global _enqueue_script
+    if _enqueue_script is None:
+        _enqueue_script = redis_client.register_script(ENQUEUE_SCRIPT)
+    now = time.time()
+    # The queue and the registry live in different cluster slots, so they are
+    # written by one pipeline rather than one script. The queue is written
+    # first: a pruner that saw it empty then finds the registry entry refreshed.
+    pipe = redis_client.pipeline(transaction=False)
+    # Point the player's index at "queued" so a previous match's "ended"
+    # tombstone no longer answers /match/status or /match/wait. Written before
+    # the queue entry, so a match formed from it always overwrites the marker.
+    pipe.set(get_player_session_key(player_id), QUEUED_MARKER, ex=SESSION_TTL_SECONDS)
+    await _enqueue_script(keys=[get_queue_key(bucket)], args=[player_id, now], client=pipe)
+    pipe.zadd(QUEUE_BUCKETS_KEY, {bucket: now})
+    _, (added, queue_len), _ = await pipe.execute()
+    return bool(added), int(queue_len)
+
+
+async def prune_queue_bucket(redis_client, bucket: str) -> bool:
+    """Unregister bucket if its queue is empty and nobody joined it for QUEUE_BUCKET_IDLE_SECONDS."""
+    global _prune_bucket_script
+    if await redis_client.zcard(get_queue_key(bucket)):
+        return False
+    if _prune_bucket_script is None:
+        _prune_bucket_script = redis_client.register_script(PRUNE_BUCKET_SCRIPT)
+    removed = await _prune_bucket_script(
+        keys=[QUEUE_BUCKETS_KEY],
+        args=[bucket, time.time() - QUEUE_BUCKET_IDLE_SECONDS],
+        client=redis_client,
+    )
+    return bool(removed)
+
+
+async def form_matches(redis_client, queue_key: str, max_matches: int) -> List[List[tuple]]:
+    """Pop the batches that are ready to be matched, each as [(player_id, queued_at)] ([] if none)."""
+    global _form_matches_script
+    if _form_matches_script is None:
+        _form_matches_script = redis_client.register_script(FORM_MATCHES_SCRIPT)
+    batches = await _form_matches_script(
+        keys=[queue_key],
+        args=[time.time(), SESSION_SIZE, MIN_PARTIAL_SESSION_SIZE, FLUSH_WAIT_SECONDS, max_matches],
+        client=redis_client,
+    )
+    return [
+        [(flat[i], float(flat[i + 1])) for i in range(0, len(flat), 2)]
+        for flat in batches or []
+    ]
+
+
+async def requeue_players(redis_client, queue_key: str, batch: List[tuple]) -> None:
+    """Put a batch whose match could not be created back in its queue at the original join times."""
+    await redis_client.zadd(queue_key, dict(batch), nx=True)
+
+
+def append_local_queue(bucket: str, player_id: str) -> bool:
+    """Queue player_id unless already queued in this bucket; returns whether it was added."""
+    queue = _local_queues.setdefault(bucket, OrderedDict())
+    if player_id in queue:
+        return False
+    queue[player_id] = time.time()
+    return True
+
+
+def requeue_local(bucket: str, batch: List[tuple]) -> None:
+    """Put a dequeued batch back at the head of its in-memory queue."""
+    queue = _local_queues.setdefault(bucket, OrderedDict())
+    for player_id, queued_at in reversed(batch):
+        queue.setdefault(player_id, queued_at)
+        queue.move_to_end(player_id, last=False)
 
 
-def append_local_queue(player_id: str) -> None:
-    _local_queue.append((player_id, time.time()))
+def local_queue_len(bucket: str) -> int:
+    return len(_local_queues.get(bucket, ()))
 
 
-def local_queue_len() -> int:
-    return len(_local_queue)
+def local_queue_buckets() -> List[str]:
+    return list(_local_queues)
 
 
-def local_oldest_wait_seconds() -> float:
-    if not _local_queue:
+def local_oldest_wait_seconds(bucket: str) -> float:
+    queue = _local_queues.get(bucket)
+    if not queue:
         return 0.0
-    return time.time() - _local_queue[0][1]
+    return time.time() - next(iter(queue.values()))
 
 
-def local_dequeue(count: int) -> List[str]:
-    players: List[str] = []
-    for _ in range(count):
-        p, _queued_at = _local_queue.popleft()
-        players.append(p)
-    return players
+def local_dequeue(bucket: str, count: int) -> List[tuple]:
+    """Pop the count longest-waiting players as [(player_id, queued_at)]."""
+    queue = _local_queues[bucket]
+    batch = [queue.popitem(last=False) for _ in range(count)]
+    if not queue:
+        del _local_queues[bucket]
+    return batch
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import List
+
+from k8s_game_server import delete_game_server_pod
+from packing import is_shared_server, release_session
+from settings import TEARDOWN_WORKERS
+from storage import claim_session_ends, get_db_pool, release_session_ends, untrack_sessions_in_redis
+
+logger = logging.getLogger(__name__)
+
+# (session_id, game_server_pod) waiting for their game server to be deleted.
+_queue: asyncio.Queue | None = None
+_pending: set = set()
+_workers: list = []
+
+
+async def _worker() -> None:
+    while True:
+        session_id, game_server_pod = await _queue.get()
+        try:
+            if is_shared_server(game_server_pod):
+                # Shared servers outlive their sessions; only free the slot.
+                await release_session(session_id, game_server_pod)
+            else:
+                await delete_game_server_pod(session_id, game_server_pod)
+        except Exception as e:  # noqa: BLE001
+            # Left for the orphaned-server cleanup to collect.
+            logger.error(f"Failed to delete game server pod for {session_id}: {e}")
+        finally:
+            _pending.discard(session_id)
+            _queue.task_done()
+
+
+def start_teardown() -> None:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    while len(_workers) < TEARDOWN_WORKERS:
+        _workers.append(loop.create_task(_worker()))
+
+
+def stop_teardown() -> None:
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
+    if _pending:
+        logger.warning(f"Shutting down with {len(_pending)} game server teardown(s) pending")
+
+
+def submit_teardown(session_id: str, game_server_pod: str | None) -> None:
+    """Queue deletion of a session's game server; repeated submissions are ignored."""
+    if _queue is None or session_id in _pending:
+        return
+    _pending.add(session_id)
+    _queue.put_nowait((session_id, game_server_pod))
+
+
+async def end_sessions(session_ids: List[str]) -> List[str]:
+    """
+    Mark sessions ended in one UPDATE, untrack them in one Redis pipeline and
+    queue their game servers for deletion. Returns the ids ended by this call;
+    sessions already ended (or being ended by another request) are skipped.
+    """
+    session_ids = await claim_session_ends(list(dict.fromkeys(session_ids)))
+    if not session_ids:
+        return []
+    try:
+        pool = await get_db_pool()
+        rows = await pool.fetch(
+            """
+            UPDATE matches SET ended_at = now()
+            WHERE session_id = ANY($1::text[]) AND ended_at IS NULL
+            RETURNING session_id, game_server_pod
+            """,
+            session_ids,
+        )
+    except Exception:
+        await release_session_ends(session_ids)
+        raise
+    ended = [row["session_id"] for row in rows]
+    await untrack_sessions_in_redis(ended)
+    for row in rows:
+        submit_teardown(row["session_id"], row["game_server_pod"])
+    return ended
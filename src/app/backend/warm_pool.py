@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import math
+import time
+
+from k8s_game_server import create_warm_game_server, drain_warm_game_server, list_warm_game_servers
+from settings import (
+    WARM_POOL_ENABLED,
+    WARM_POOL_LEAD_SECONDS,
+    WARM_POOL_MAX_SIZE,
+    WARM_POOL_MIN_SIZE,
+    WARM_POOL_RATE_WINDOW_SECONDS,
+    WARM_POOL_REPLENISH_INTERVAL_SECONDS,
+)
+from storage import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+MATCH_TIMES_KEY = "warm_pool:match_times"
+REPLENISH_LOCK_KEY = "warm_pool:replenish_lock"
+
+_task: asyncio.Task | None = None
+_local_match_times: list[float] = []
+
+
+async def record_match_formed(session_id: str) -> None:
+    """Feed the match-rate estimate that sizes the warm pool."""
+    if not WARM_POOL_ENABLED:
+        return
+    now = time.time()
+    redis_client = await get_redis_client()
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.zadd(MATCH_TIMES_KEY, {session_id: now})
+            pipe.zremrangebyscore(MATCH_TIMES_KEY, "-inf", now - WARM_POOL_RATE_WINDOW_SECONDS)
+            await pipe.execute()
+            return
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to record match time in Redis: {e}")
+    _local_match_times.append(now)
+
+
+async def _recent_match_count() -> int:
+    since = time.time() - WARM_POOL_RATE_WINDOW_SECONDS
+    redis_client = await get_redis_client()
+    if redis_client:
+        try:
+            return int(await redis_client.zcount(MATCH_TIMES_KEY, since, "+inf"))
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Failed to read match rate from Redis: {e}")
+    _local_match_times[:] = [t for t in _local_match_times if t >= since]
+    return len(_local_match_times)
+
+
+async def target_pool_size() -> int:
+    rate = await _recent_match_count() / WARM_POOL_RATE_WINDOW_SECONDS
+    wanted = math.ceil(rate * WARM_POOL_LEAD_SECONDS)
+    return max(WARM_POOL_MIN_SIZE, min(WARM_POOL_MAX_SIZE, wanted))
+
+
+async def _acquire_replenish_lock() -> bool:
+    """Only one backend replica replenishes per interval."""
+    redis_client = await get_redis_client()
+    if not redis_client:
+        return True
+    try:
+        ttl = max(1, int(WARM_POOL_REPLENISH_INTERVAL_SECONDS))
+        return bool(await redis_client.set(REPLENISH_LOCK_KEY, "1", nx=True, ex=ttl))
+    except Exception:  # noqa: BLE001
+        return True
+
+
+async def replenish_once() -> None:
+    if not await _acquire_replenish_lock():
+        return
+    target = await target_pool_size()
+    current = len(await list_warm_game_servers())
+    if current < target:
+        await asyncio.gather(*(create_warm_game_server() for _ in range(target - current)))
+        logger.info(f"Warm pool replenished {current} -> {target}")
+    elif current > target:
+        # Shrink slowly; a burst of matches right after a lull should still find servers.
+        if await drain_warm_game_server():
+            logger.info(f"Warm pool drained one server ({current} > target {target})")
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await replenish_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"Warm pool replenish failed: {e}")
+        await asyncio.sleep(WARM_POOL_REPLENISH_INTERVAL_SECONDS)
+
+
+def start_warm_pool() -> None:
+    global _task
+    if not WARM_POOL_ENABLED or _task is not None:
+        return
+    _task = asyncio.get_running_loop().create_task(_run())
+    logger.info(f"Warm pool enabled (min={WARM_POOL_MIN_SIZE}, max={WARM_POOL_MAX_SIZE})")
+
+
+def stop_warm_pool() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
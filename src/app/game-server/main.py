@@ -1,71 +1,168 @@
 """
 Game server: TCP server with authoritative state (open -> running -> stop).
 Match config (e.g. duration) is decided by clients (custom match); server notifies
-clients on state changes and closes itself when done or when no clients remain in running.
+clients on state changes and closes a session when done or when no clients remain in running.
+Started without SESSION_ID, the server idles in a warm pool until the backend
+claims it with ASSIGN_SESSION <session_id>.
+
+With MAX_SESSIONS > 1 one process hosts up to that many sessions. The backend
+adds sessions with ASSIGN_SESSION, clients pick theirs with JOIN <session_id>
+as the first line, and CAPACITY reports "<active> <max>". Finished sessions
+free their slot instead of stopping the process.
+
+Backend commands (ASSIGN_SESSION, END_SESSION, CAPACITY) are only served on
+CONTROL_PORT, which is reachable in-cluster but never exposed to players.
 """
 import asyncio
 import os
 import sys
 import time
 
-SESSION_ID = os.getenv("SESSION_ID", "unknown")
+# Empty when started as a warm-pool server; set later via ASSIGN_SESSION.
+SESSION_ID = os.getenv("SESSION_ID", "")
 PORT = int(os.getenv("PORT", "8080"))
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "8081"))
+MAX_SESSIONS = max(1, int(os.getenv("MAX_SESSIONS", "1")))
+MULTI_SESSION = MAX_SESSIONS > 1
+# Multi-session only: drop an assigned session nobody has joined after this long.
+SESSION_IDLE_TIMEOUT_SECONDS = float(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "120"))
 
-# State: open -> running -> stop (server-authoritative)
-_state = "open"
-# Match duration in seconds; set by first client via REQUEST_MATCH <sec>
-_match_duration_seconds: float | None = None
-# When we transitioned to running (time.time())
-_running_started_at: float | None = None
-_clients: list[asyncio.StreamWriter] = []
-_state_lock = asyncio.Lock()
 _shutdown = asyncio.Event()
 
 
-def _get_state() -> str:
-    return _state
+class Session:
+    """One match: state open -> running -> stop (server-authoritative)."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.state = "open"
+        # Match duration in seconds; set by first client via REQUEST_MATCH <sec>
+        self.match_duration_seconds: float | None = None
+        # When we transitioned to running (time.time())
+        self.running_started_at: float | None = None
+        self.clients: list[asyncio.StreamWriter] = []
+        self.lock = asyncio.Lock()
+        self.created_at = time.time()
+
+    async def broadcast(self, line: str) -> None:
+        """Send a line to all clients of this session (with newline)."""
+        msg = (line if line.endswith("\n") else line + "\n").encode()
+        async with self.lock:
+            for w in self.clients:
+                try:
+                    w.write(msg)
+                    await w.drain()
+                except Exception:  # noqa: BLE001
+                    pass
+
+    async def run_timer(self, duration_seconds: float) -> None:
+        """After duration_seconds in 'running', transition to stop and finish the session."""
+        await asyncio.sleep(duration_seconds)
+        async with self.lock:
+            if self.state != "running":
+                return
+            self.state = "stop"
+        await self.broadcast("STATE stop")
+        await _finish_session(self)
 
+    def check_empty_and_stop(self) -> bool:
+        """If in running state and no clients left, close session early. Call with lock held."""
+        if self.state == "running" and len(self.clients) == 0:
+            self.state = "stop"
+            return True
+        return False
 
-def _set_state(new: str) -> None:
-    global _state
-    _state = new
 
+# session_id -> Session. Single-session servers keep exactly one entry, keyed
+# by SESSION_ID ("" while an unassigned warm-pool server).
+_sessions: dict[str, Session] = {}
+_registry_lock = asyncio.Lock()
 
-async def _broadcast(line: str) -> None:
-    """Send a line to all connected clients (with newline)."""
-    msg = (line if line.endswith("\n") else line + "\n").encode()
-    async with _state_lock:
-        for w in _clients:
-            try:
-                w.write(msg)
-                await w.drain()
-            except Exception:  # noqa: BLE001
-                pass
 
+def _default_session() -> Session | None:
+    """Session used by connections that never sent JOIN (single-session servers only)."""
+    if MULTI_SESSION:
+        return None
+    return next(iter(_sessions.values()), None)
 
-async def _run_timer(duration_seconds: float) -> None:
-    """After duration_seconds in 'running', transition to stop and trigger shutdown."""
-    await asyncio.sleep(duration_seconds)
-    async with _state_lock:
-        if _get_state() != "running":
-            return
-        _set_state("stop")
-    await _broadcast("STATE stop")
-    _shutdown.set()
 
+def _assign_session(session_id: str) -> str:
+    """
+    Bind session_id to this server. Returns "ok", "full" or "already_assigned".
+    Re-assigning a session the server already hosts is a no-op.
+    """
+    global SESSION_ID
+    if session_id in _sessions:
+        return "ok"
+    if MULTI_SESSION:
+        if len(_sessions) >= MAX_SESSIONS:
+            return "full"
+        session = Session(session_id)
+        _sessions[session_id] = session
+        asyncio.create_task(_expire_if_unjoined(session))
+        return "ok"
+    if SESSION_ID and SESSION_ID != session_id:
+        return "already_assigned"
+    # Warm-pool server: re-key the idle session.
+    session = _sessions.pop(SESSION_ID, None) or Session(session_id)
+    session.session_id = session_id
+    _sessions[session_id] = session
+    SESSION_ID = session_id
+    return "ok"
 
-def _check_empty_and_stop() -> None:
-    """If in running state and no clients left, close session early."""
-    global _state
-    if _state == "running" and len(_clients) == 0:
-        _set_state("stop")
+
+async def _finish_session(session: Session) -> None:
+    """A session reached stop: free its slot (multi) or stop the process (single)."""
+    if not MULTI_SESSION:
         _shutdown.set()
+        return
+    async with _registry_lock:
+        if _sessions.get(session.session_id) is session:
+            del _sessions[session.session_id]
+    async with session.lock:
+        clients = session.clients[:]
+        session.clients.clear()
+    for w in clients:
+        try:
+            w.close()
+        except Exception:  # noqa: BLE001
+            pass
+
+
+async def _expire_if_unjoined(session: Session) -> None:
+    await asyncio.sleep(SESSION_IDLE_TIMEOUT_SECONDS)
+    async with session.lock:
+        idle = session.state == "open" and not session.clients
+        if idle:
+            session.state = "stop"
+    if idle:
+        await _finish_session(session)
+
+
+async def _end_session(session_id: str) -> bool:
+    """Backend-initiated end (END_SESSION): stop the session and notify its clients."""
+    session = _sessions.get(session_id)
+    if session is None:
+        return False
+    async with session.lock:
+        already_stopped = session.state == "stop"
+        session.state = "stop"
+    if not already_stopped:
+        await session.broadcast("STATE stop")
+    await _finish_session(session)
+    return True
+
+
+async def _reply(writer: asyncio.StreamWriter, line: str) -> None:
+    writer.write(f"{line}\n".encode())
+    await writer.drain()
 
 
 async def _handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
-    global _match_duration_seconds
-    async with _state_lock:
-        _clients.append(writer)
+    session = _default_session()
+    if session is not None:
+        async with session.lock:
+            session.clients.append(writer)
 
     try:
         while True:
@@ -74,51 +171,99 @@ async def _handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWri
                 break
             raw = line.decode().strip()
             cmd = raw.upper()
-            if cmd == "GET_STATE":
-                writer.write(f"STATE {_get_state()}\n".encode())
-                await writer.drain()
+            parts = raw.split()
+            if cmd.startswith("JOIN "):
+                target = _sessions.get(parts[1]) if len(parts) == 2 else None
+                if target is None or target.state == "stop":
+                    await _reply(writer, "ERROR unknown_session")
+                    continue
+                if session is not target:
+                    if session is not None:
+                        async with session.lock:
+                            if writer in session.clients:
+                                session.clients.remove(writer)
+                    session = target
+                    async with session.lock:
+                        session.clients.append(writer)
+                await _reply(writer, f"JOINED {session.session_id}")
+            elif cmd == "GET_SESSION":
+                await _reply(writer, f"SESSION {(session.session_id if session else '') or '-'}")
+            elif session is None:
+                await _reply(writer, "ERROR join_required")
+            elif cmd == "GET_STATE":
+                await _reply(writer, f"STATE {session.state}")
             elif cmd == "GET_RUNNING_LENGTH":
-                dur = _match_duration_seconds
-                if dur is not None:
-                    writer.write(f"RUNNING_LENGTH {int(dur)}\n".encode())
-                else:
-                    writer.write(b"RUNNING_LENGTH 0\n")
-                await writer.drain()
+                dur = session.match_duration_seconds
+                await _reply(writer, f"RUNNING_LENGTH {int(dur) if dur is not None else 0}")
             elif cmd.startswith("REQUEST_MATCH "):
                 # Client requests custom match duration (seconds). First one wins.
-                parts = raw.split()
                 if len(parts) == 2:
                     try:
                         sec = float(parts[1])
                         if sec > 0 and sec <= 86400:  # cap 24h
                             started_now = False
-                            async with _state_lock:
-                                if _match_duration_seconds is None and _get_state() == "open":
-                                    _match_duration_seconds = sec
-                                    _set_state("running")
-                                    global _running_started_at
-                                    _running_started_at = time.time()
-                                    asyncio.create_task(_run_timer(sec))
+                            async with session.lock:
+                                if session.match_duration_seconds is None and session.state == "open":
+                                    session.match_duration_seconds = sec
+                                    session.state = "running"
+                                    session.running_started_at = time.time()
+                                    asyncio.create_task(session.run_timer(sec))
                                     started_now = True
-                            writer.write(f"RUNNING_LENGTH {int(_match_duration_seconds or 0)}\n".encode())
-                            await writer.drain()
+                            await _reply(writer, f"RUNNING_LENGTH {int(session.match_duration_seconds or 0)}")
                             if started_now:
-                                await _broadcast("STATE running")
+                                await session.broadcast("STATE running")
                             continue
                     except ValueError:
                         pass
-                writer.write(b"UNKNOWN\n")
-                await writer.drain()
+                await _reply(writer, "UNKNOWN")
+            else:
+                await _reply(writer, "UNKNOWN")
+    except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+        pass
+    finally:
+        if session is not None:
+            async with session.lock:
+                if writer in session.clients:
+                    session.clients.remove(writer)
+                stopped = session.check_empty_and_stop()
+            if stopped:
+                await _finish_session(session)
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:  # noqa: BLE001
+            pass
+
+
+async def _handle_control(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Backend commands on CONTROL_PORT: one reply line per command."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            raw = line.decode().strip()
+            cmd = raw.upper()
+            parts = raw.split()
+            if cmd == "CAPACITY":
+                await _reply(writer, f"CAPACITY {len(_sessions)} {MAX_SESSIONS}")
+            elif cmd.startswith("ASSIGN_SESSION ") and len(parts) == 2:
+                async with _registry_lock:
+                    result = _assign_session(parts[1])
+                if result == "ok":
+                    await _reply(writer, f"ASSIGNED {parts[1]}")
+                else:
+                    await _reply(writer, f"ERROR {result}")
+            elif cmd.startswith("END_SESSION "):
+                if len(parts) == 2 and await _end_session(parts[1]):
+                    await _reply(writer, f"ENDED {parts[1]}")
+                else:
+                    await _reply(writer, "ERROR unknown_session")
             else:
-                writer.write(b"UNKNOWN\n")
-                await writer.drain()
+                await _reply(writer, "UNKNOWN")
     except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
         pass
     finally:
-        async with _state_lock:
-            if writer in _clients:
-                _clients.remove(writer)
-            _check_empty_and_stop()
         try:
             writer.close()
             await writer.wait_closed()
@@ -127,20 +272,25 @@ async def _handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWri
 
 
 async def _serve() -> None:
+    if not MULTI_SESSION or SESSION_ID:
+        _sessions[SESSION_ID] = Session(SESSION_ID)
     server = await asyncio.start_server(_handle_client, "0.0.0.0", PORT)
-    async with server:
+    control_server = await asyncio.start_server(_handle_control, "0.0.0.0", CONTROL_PORT)
+    async with server, control_server:
         await _shutdown.wait()
-    server.close()
-    await server.wait_closed()
+    for srv in (server, control_server):
+        srv.close()
+        await srv.wait_closed()
     # Close all client connections before exiting
-    async with _state_lock:
-        for w in _clients[:]:
-            try:
-                w.close()
-                await w.wait_closed()
-            except Exception:  # noqa: BLE001
-                pass
-            _clients.clear()
+    for session in list(_sessions.values()):
+        async with session.lock:
+            for w in session.clients[:]:
+                try:
+                    w.close()
+                    await w.wait_closed()
+                except Exception:  # noqa: BLE001
+                    pass
+            session.clients.clear()
 
 
 def main() -> int:
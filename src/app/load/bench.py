@@ -0,0 +1,117 @@
+import argparse
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * pct / 100.0), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _sample_proxy_health(base_url: str, samples: int) -> list:
+    """/health answers from whichever proxy replica the Service picks; collect a few."""
+    seen = []
+    for _ in range(samples):
+        try:
+            data = requests.get(f"{base_url}/health", timeout=2.0).json()
+            if data.get("backends"):
+                seen.append(data["backends"])
+        except Exception:  # noqa: BLE001
+            pass
+    return seen
+
+
+def _worker(base_url: str, deadline: float, latencies: list, errors: list, lock: threading.Lock) -> None:
+    session = requests.Session()
+    local_latencies = []
+    local_errors = 0
+    while time.time() < deadline:
+        # Unique player ids defeat the proxy status cache so every request reaches a backend.
+        player_id = f"bench-{uuid.uuid4()}"
+        started = time.perf_counter()
+        try:
+            resp = session.get(
+                f"{base_url}/api/match/status",
+                params={"player_id": player_id},
+                timeout=10.0,
+            )
+            if resp.status_code != 200:
+                local_errors += 1
+        except Exception:  # noqa: BLE001
+            local_errors += 1
+        local_latencies.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def main() -> None:
+    """
+    Proxy -> backend transport benchmark.
+
+    Usage:
+      python bench.py --concurrency 400 --duration 60
+
+    Hammers /api/match/status through the proxy and reports throughput and
+    latency percentiles, plus the proxy's open backend sockets from /health.
+    Run it once with BACKEND_HTTP2=0 and once with BACKEND_HTTP2=1 (proxy and
+    backend) with the proxy scaled to the HPA maximum, e.g.
+      kubectl scale deployment/game-proxy --replicas=20
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=os.getenv("TARGET_URL", "http://localhost:8080"))
+    parser.add_argument("--concurrency", type=int, default=200, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--health-samples", type=int, default=20, help="/health samples for socket counts")
+    args = parser.parse_args()
+
+    latencies: list = []
+    errors: list = []
+    lock = threading.Lock()
+    deadline = time.time() + args.duration
+    threads = [
+        threading.Thread(
+            target=_worker,
+            args=(args.url, deadline, latencies, errors, lock),
+            daemon=True,
+        )
+        for _ in range(args.concurrency)
+    ]
+    print(f"Running {args.concurrency} clients for {args.duration:.0f}s against {args.url}")
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    # Sample sockets while the load is running, not after the pools go idle.
+    time.sleep(args.duration / 2)
+    health = _sample_proxy_health(args.url, args.health_samples)
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"requests={total} errors={sum(errors)} rps={total / elapsed:.0f}")
+    print(
+        "latency_ms "
+        + " ".join(
+            f"p{pct:g}={_percentile(latencies, pct) * 1000:.1f}"
+            for pct in (50, 90, 99, 99.9)
+        )
+    )
+    if health:
+        connections = sorted(h.get("connections", 0) for h in health)
+        print(
+            f"backend_sockets_per_proxy median={_percentile(connections, 50)} "
+            f"max={connections[-1]} (from {len(health)} /health samples)"
+        )
+        print(f"backend_pods_seen={max(h.get('endpoints', 0) for h in health)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -37,7 +37,7 @@ class GameClient:
                     f"state=matched session={self.session_id} server={self.connect_host}:{self.connect_port}"
                 )
             else:
-                self._log(f"state=queued session={self.session_id}")
+                self._log(f"state={data.get('status') or 'queued'} session={self.session_id}")
             return data
         except Exception as e:  # noqa: BLE001
             self._log(f"state=join_error error={e}")
@@ -61,6 +61,25 @@ class GameClient:
             self._log(f"state=status_error error={e}")
             return None
 
+    def wait_for_match(self, timeout: float = 25.0) -> dict | None:
+        """Long-poll until matched/ended; returns the latest status when the wait times out."""
+        try:
+            resp = requests.get(
+                f"{self.base_url}/api/match/wait",
+                params={"player_id": self.player_id, "timeout": timeout},
+                timeout=timeout + 10.0,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            if data.get("status") == "matched":
+                self.session_id = data.get("session_id")
+                self.connect_host = self.game_server_host_override or data.get("connect_host")
+                self.connect_port = data.get("connect_port", 0)
+            return data
+        except Exception as e:  # noqa: BLE001
+            self._log(f"state=wait_error error={e}")
+            return None
+
     def end_match(self) -> bool:
         if not self.session_id or self.session_id.startswith("pending"):
             return False
@@ -116,6 +135,17 @@ class GameClient:
         if sock is None:
             return None
         try:
+            # Bind the connection to our session (required on multi-session servers).
+            sock.sendall(f"JOIN {self.session_id}\n".encode())
+            reply = b""
+            while not reply.endswith(b"\n"):
+                chunk = sock.recv(1)
+                if not chunk:
+                    break
+                reply += chunk
+            if reply.decode().strip() != f"JOINED {self.session_id}":
+                self._log(f"state=join_failed reply={reply.decode().strip()}")
+                return None
             sock.sendall(f"REQUEST_MATCH {match_duration_seconds}\n".encode())
             first_payload = sock.recv(512).decode()
             for line in first_payload.splitlines():
@@ -6,8 +6,8 @@ from client import GameClient
 
 def simulate_client_lifecycle(base_url: str, match_duration: float) -> None:
     """
-    Flow: join queue at proxy -> backend allocates game server when ready ->
-    proxy returns address (in join response or via status poll) -> play -> end.
+    Flow: join queue at proxy -> backend returns a ticket and provisions the
+    game server in the background -> address arrives via long-poll wait -> play -> end.
     """
     player_id = str(uuid.uuid4())
     client = GameClient(base_url, player_id)
@@ -16,15 +16,13 @@ def simulate_client_lifecycle(base_url: str, match_duration: float) -> None:
     if not result:
         return
 
-    session_id = result.get("session_id", "")
-    if result.get("connect_host") and result.get("connect_port"):
-        pass
-    elif session_id.startswith("pending"):
+    if not (result.get("connect_host") and result.get("connect_port")):
         max_wait = 60.0
         wait_start = time.time()
         last_status = None
         while time.time() - wait_start < max_wait:
-            status = client.poll_status()
+            remaining = max(1.0, min(25.0, max_wait - (time.time() - wait_start)))
+            status = client.wait_for_match(timeout=remaining)
             if status:
                 current = status.get("status")
                 if current != last_status:
@@ -38,13 +36,11 @@ def simulate_client_lifecycle(base_url: str, match_duration: float) -> None:
             if status and status.get("status") == "ended":
                 client._log("state=session_ended_before_connect")
                 return
-            time.sleep(0.5)
+            if status is None:
+                time.sleep(0.5)  # back off after a failed wait before retrying
         if not client.session_id or not client.connect_host:
             client._log("state=match_timeout_waiting_for_server")
             return
-    else:
-        if not client.connect_host:
-            return
 
     client.connect_and_wait_for_stop(match_duration_seconds=30, recv_timeout=max(60.0, 30 + 10))
     client._log(f"state=ending_session session={client.session_id}")
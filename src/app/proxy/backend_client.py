@@ -1,43 +1,107 @@
-import os
+import asyncio
+import time
 
 import httpx
 from fastapi import HTTPException
+from starlette.responses import StreamingResponse
+
+from endpoints import (
+    Endpoint,
+    all_endpoints,
+    endpoint_stats,
+    pick_endpoint,
+    record_failure,
+    record_success,
+    start_endpoint_discovery,
+    stop_endpoint_discovery,
+)
+from settings import (
+    BACKEND_HEDGE_DELAY_SECONDS,
+    BACKEND_HTTP2,
+    BACKEND_KEEPALIVE_EXPIRY_SECONDS,
+    BACKEND_MAX_ATTEMPTS,
+    BACKEND_MAX_CONNECTIONS,
+    BACKEND_MAX_KEEPALIVE_CONNECTIONS,
+    BACKEND_PREWARM_CONNECTIONS,
+    BACKEND_SLOW_SECONDS,
+)
 
 
-BACKEND_URL = os.getenv("BACKEND_URL", "http://game-backend:8080")
 _client: httpx.AsyncClient | None = None
 
 
 async def startup_client() -> None:
     global _client
-    limits = httpx.Limits(max_keepalive_connections=100, max_connections=200)
+    limits = httpx.Limits(
+        max_keepalive_connections=BACKEND_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections=BACKEND_MAX_CONNECTIONS,
+        keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    # No base_url: every request is addressed to the backend pod picked in _send.
+    # http1=False makes HTTP/2 cleartext use prior knowledge (h2c) instead of TLS ALPN.
     _client = httpx.AsyncClient(
-        base_url=BACKEND_URL,
         timeout=30.0,
         limits=limits,
+        http1=not BACKEND_HTTP2,
+        http2=BACKEND_HTTP2,
     )
+    await start_endpoint_discovery(on_added=prewarm_connections)
+    await prewarm_connections(all_endpoints())
 
 
 async def shutdown_client() -> None:
     global _client
+    await stop_endpoint_discovery()
     if _client is not None:
         await _client.aclose()
         _client = None
 
 
+async def prewarm_connections(endpoints: list) -> None:
+    """Open pooled connections to each backend pod so the first requests skip the TCP handshake."""
+    if _client is None or not endpoints:
+        return
+    per_endpoint = 1 if BACKEND_HTTP2 else BACKEND_PREWARM_CONNECTIONS
+    per_endpoint = min(per_endpoint, max(BACKEND_MAX_KEEPALIVE_CONNECTIONS // len(endpoints), 1))
+    # Concurrent requests force distinct HTTP/1.1 connections; they stay in the keepalive pool.
+    results = await asyncio.gather(
+        *(
+            _client.get(endpoint.base_url + "/health", timeout=2.0)
+            for endpoint in endpoints
+            for _ in range(per_endpoint)
+        ),
+        return_exceptions=True,
+    )
+    warmed = sum(1 for r in results if isinstance(r, httpx.Response))
+    print(f"Prewarmed {warmed}/{len(results)} backend connections across {len(endpoints)} pod(s)")
+
+
+def pool_connections() -> int:
+    """Open proxy -> backend sockets (reported by /health for benchmarking)."""
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    return len(getattr(pool, "connections", ()))
+
+
 async def health_backend() -> dict:
     if _client is None:
         return {"status": "degraded", "reason": "client_not_initialized"}
+    stats = endpoint_stats()
+    stats["connections"] = pool_connections()
     try:
-        resp = await _client.get("/health", timeout=2.0)
+        resp = await _send("GET", "/health", timeout=2.0)
+        await resp.aclose()
         if resp.status_code == 200:
-            return {"status": "ok"}
-        return {"status": "degraded", "reason": f"backend_status_{resp.status_code}"}
+            return {"status": "ok", "backends": stats}
+        return {"status": "degraded", "reason": f"backend_status_{resp.status_code}", "backends": stats}
     except Exception:  # noqa: BLE001
-        return {"status": "degraded", "reason": "backend_unreachable"}
+        return {"status": "degraded", "reason": "backend_unreachable", "backends": stats}
+
 
+# Backend response headers relayed to the client; hop-by-hop headers are dropped.
+PASSTHROUGH_HEADERS = ("content-type", "content-length", "content-encoding", "cache-control")
 
-async def forward_json(
+
+async def forward_raw(
     method: str,
     path: str,
     *,
@@ -45,23 +109,229 @@ async def forward_json(
     params: dict | None = None,
     headers: dict | None = None,
     timeout: float = 10.0,
-):
-    if _client is None:
-        raise HTTPException(status_code=503, detail="Proxy not ready")
+    hedge: bool = False,
+    long_lived: bool = False,
+) -> StreamingResponse:
+    """
+    Relay a backend response byte-for-byte: status, relevant headers and the raw
+    body stream. Nothing is decoded or re-encoded in the proxy. long_lived marks
+    streams held open for a long time, exempt from BACKEND_MAX_OUTSTANDING.
+    """
+    resp = await _send(
+        method,
+        path,
+        content=content,
+        params=params,
+        headers=headers,
+        timeout=timeout,
+        hedge=hedge,
+        long_lived=long_lived,
+    )
+    return StreamingResponse(
+        _relay_body(resp),
+        status_code=resp.status_code,
+        headers=_passthrough_headers(resp),
+    )
+
+
+async def _relay_body(resp: httpx.Response):
+    # Close in finally rather than a background task: Starlette skips the
+    # background task when streaming fails (client disconnect, mid-body read
+    # error), which would leak the pooled connection and its outstanding count.
     try:
-        if method == "GET":
-            resp = await _client.get(path, params=params, timeout=timeout, headers=headers)
-        elif method == "POST":
-            resp = await _client.post(path, content=content, timeout=timeout, headers=headers)
-        else:
-            raise HTTPException(status_code=500, detail=f"Unsupported method: {method}")
-        resp.raise_for_status()
-        return resp.json()
+        async for chunk in resp.aiter_raw():
+            yield chunk
+    finally:
+        await resp.aclose()
+
+
+async def fetch_raw(
+    method: str,
+    path: str,
+    *,
+    content: bytes | None = None,
+    params: dict | None = None,
+    headers: dict | None = None,
+    timeout: float = 10.0,
+    hedge: bool = False,
+) -> tuple[int, dict, bytes]:
+    """Buffered variant of forward_raw for callers that reuse the bytes (e.g. the status cache)."""
+    resp = await _send(
+        method, path, content=content, params=params, headers=headers, timeout=timeout, hedge=hedge
+    )
+    try:
+        body = b"".join([chunk async for chunk in resp.aiter_raw()])
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Backend timeout")
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"Backend connection error: {str(e)}")
-    except HTTPException:
+    finally:
+        await resp.aclose()
+    headers = _passthrough_headers(resp)
+    headers.pop("content-length", None)
+    return resp.status_code, headers, body
+
+
+def _passthrough_headers(resp: httpx.Response) -> dict:
+    return {k: v for k, v in resp.headers.items() if k.lower() in PASSTHROUGH_HEADERS}
+
+
+def _retryable(method: str, exc: Exception) -> bool:
+    # A POST is only retried when the request never reached a backend.
+    if method == "GET":
+        return True
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def _close_when_done(task: asyncio.Task) -> None:
+    """Release the response of an attempt that lost a hedge race, whenever it completes."""
+    def _close(t: asyncio.Task) -> None:
+        if not t.cancelled() and t.exception() is None:
+            asyncio.get_running_loop().create_task(t.result().aclose())
+
+    task.add_done_callback(_close)
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that keeps its request outstanding on the endpoint until closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, endpoint: Endpoint, long_lived: bool):
+        self._stream = stream
+        self._endpoint = endpoint
+        self._long_lived = long_lived
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if not self._closed:
+            self._closed = True
+            _release(self._endpoint, self._long_lived)
+        await self._stream.aclose()
+
+
+def _release(endpoint: Endpoint, long_lived: bool) -> None:
+    endpoint.outstanding -= 1
+    if long_lived:
+        endpoint.long_lived -= 1
+
+
+async def _attempt(
+    endpoint: Endpoint, req: httpx.Request, slow_after: float | None, long_lived: bool
+) -> httpx.Response:
+    """
+    One request to one backend pod, feeding its outstanding count and circuit
+    breaker. The request stays outstanding until its body stream is closed, so
+    pods serving long streams (SSE waits, NDJSON listings) don't look idle.
+    """
+    endpoint.outstanding += 1
+    if long_lived:
+        endpoint.long_lived += 1
+    started = time.monotonic()
+    try:
+        resp = await _client.send(req, stream=True)
+    except BaseException as e:
+        _release(endpoint, long_lived)
+        if isinstance(e, httpx.TransportError):
+            record_failure(endpoint)
         raise
+    resp.stream = _TrackedStream(resp.stream, endpoint, long_lived)
+    if resp.status_code >= 500 or (slow_after is not None and time.monotonic() - started > slow_after):
+        record_failure(endpoint)
+    else:
+        record_success(endpoint)
+    return resp
+
+
+async def _send(
+    method: str,
+    path: str,
+    *,
+    content: bytes | None = None,
+    params: dict | None = None,
+    headers: dict | None = None,
+    timeout: float = 10.0,
+    hedge: bool = False,
+    long_lived: bool = False,
+) -> httpx.Response:
+    """
+    Send to the least-loaded healthy backend pod, retrying on another pod up to
+    BACKEND_MAX_ATTEMPTS. With hedge=True (short idempotent GETs only) a second
+    pod is also tried once the first has not answered within
+    BACKEND_HEDGE_DELAY_SECONDS, and the first usable response wins.
+    """
+    if _client is None:
+        raise HTTPException(status_code=503, detail="Proxy not ready")
+    if method not in ("GET", "POST"):
+        raise HTTPException(status_code=500, detail=f"Unsupported method: {method}")
+    hedge = hedge and method == "GET"
+    slow_after = BACKEND_SLOW_SECONDS if hedge else None
+    tried: list = []
+    pending: set = set()
+    last_error: Exception | None = None
+    fallback: httpx.Response | None = None
+    launch = True
+    try:
+        while True:
+            if launch and len(tried) < BACKEND_MAX_ATTEMPTS:
+                endpoint = pick_endpoint(exclude=tried)
+                if endpoint is not None:
+                    tried.append(endpoint)
+                    req = _client.build_request(
+                        method,
+                        endpoint.base_url + path,
+                        content=content,
+                        params=params,
+                        headers=headers,
+                        timeout=timeout,
+                    )
+                    pending.add(asyncio.create_task(_attempt(endpoint, req, slow_after, long_lived)))
+            launch = False
+            if not pending:
+                break
+            can_hedge = hedge and len(tried) < BACKEND_MAX_ATTEMPTS
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=BACKEND_HEDGE_DELAY_SECONDS if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                launch = True  # hedge delay elapsed
+                continue
+            for task in done:
+                try:
+                    resp = task.result()
+                except httpx.TransportError as e:
+                    last_error = e
+                    launch = launch or _retryable(method, e)
+                    continue
+                if resp.status_code >= 500 and method == "GET":
+                    # Keep the 5xx as a fallback answer while other pods get a chance.
+                    if fallback is not None:
+                        await fallback.aclose()
+                    fallback = resp
+                    launch = True
+                    continue
+                if fallback is not None:
+                    await fallback.aclose()
+                for other in done - {task}:
+                    _close_when_done(other)
+                return resp
     except Exception as e:  # noqa: BLE001
+        if fallback is not None:
+            await fallback.aclose()
         raise HTTPException(status_code=500, detail=f"Proxy error: {str(e)}")
+    finally:
+        for task in pending:
+            task.cancel()
+            _close_when_done(task)
+
+    if fallback is not None:
+        return fallback
+    if last_error is None:
+        raise HTTPException(status_code=503, detail="No backend available")
+    if isinstance(last_error, httpx.TimeoutException):
+        raise HTTPException(status_code=504, detail="Backend timeout")
+    raise HTTPException(status_code=502, detail=f"Backend connection error: {str(last_error)}")
@@ -0,0 +1,148 @@
+"""Backend pod discovery and selection: headless-Service DNS, least outstanding requests, outlier ejection."""
+import asyncio
+import random
+import socket
+import time
+from typing import Awaitable, Callable
+
+from settings import (
+    BACKEND_DNS_REFRESH_SECONDS,
+    BACKEND_EJECT_FAILURES,
+    BACKEND_EJECT_MAX_SECONDS,
+    BACKEND_EJECT_SECONDS,
+    BACKEND_HEADLESS_HOST,
+    BACKEND_MAX_OUTSTANDING,
+    BACKEND_PORT,
+    BACKEND_URL,
+)
+
+
+class Endpoint:
+    __slots__ = ("base_url", "outstanding", "long_lived", "failures", "ejections", "ejected_until")
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.outstanding = 0
+        # Of outstanding, long-lived streams (match waits, listings): they count
+        # for least-outstanding selection but not toward BACKEND_MAX_OUTSTANDING.
+        self.long_lived = 0
+        self.failures = 0  # consecutive
+        self.ejections = 0  # consecutive ejections, drives the backoff
+        self.ejected_until = 0.0
+
+    def ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+
+# base_url -> Endpoint; replaced wholesale on refresh, existing entries keep their state.
+_endpoints: dict = {BACKEND_URL: Endpoint(BACKEND_URL)}
+_refresh_task: asyncio.Task | None = None
+
+
+async def _resolve() -> set:
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        BACKEND_HEADLESS_HOST, BACKEND_PORT, type=socket.SOCK_STREAM
+    )
+    return {info[4][0] for info in infos}
+
+
+async def refresh_endpoints() -> list:
+    """
+    Re-resolve the headless Service; an empty or failed lookup keeps the current set.
+    Returns the endpoints that were added.
+    """
+    global _endpoints
+    try:
+        addresses = await _resolve()
+    except OSError as e:
+        print(f"Backend DNS lookup for {BACKEND_HEADLESS_HOST} failed: {e}")
+        return []
+    if not addresses:
+        return []
+    urls = {
+        f"http://[{a}]:{BACKEND_PORT}" if ":" in a else f"http://{a}:{BACKEND_PORT}"
+        for a in addresses
+    }
+    if urls == set(_endpoints):
+        return []
+    added = [Endpoint(url) for url in urls if url not in _endpoints]
+    _endpoints = {url: _endpoints.get(url) for url in urls if url in _endpoints}
+    _endpoints.update((e.base_url, e) for e in added)
+    print(f"Backend endpoints: {sorted(urls)}")
+    return added
+
+
+async def _refresh_loop(on_added: Callable[[list], Awaitable[None]] | None) -> None:
+    while True:
+        await asyncio.sleep(BACKEND_DNS_REFRESH_SECONDS)
+        added = await refresh_endpoints()
+        if added and on_added is not None:
+            await on_added(added)
+
+
+async def start_endpoint_discovery(on_added: Callable[[list], Awaitable[None]] | None = None) -> None:
+    """Resolve backend pods now and keep refreshing; on_added runs for pods that appear later."""
+    global _refresh_task
+    if not BACKEND_HEADLESS_HOST or _refresh_task is not None:
+        return
+    await refresh_endpoints()
+    _refresh_task = asyncio.get_running_loop().create_task(_refresh_loop(on_added))
+
+
+async def stop_endpoint_discovery() -> None:
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
+
+
+def pick_endpoint(exclude=()) -> Endpoint | None:
+    """
+    Least outstanding requests among healthy pods, random among ties.
+    If every pod is ejected, route to the one whose ejection ends first rather
+    than failing everything; None only when all pods are at BACKEND_MAX_OUTSTANDING
+    short requests.
+    """
+    now = time.monotonic()
+    candidates = [
+        e for e in _endpoints.values()
+        if e not in exclude and e.outstanding - e.long_lived < BACKEND_MAX_OUTSTANDING
+    ]
+    if not candidates:
+        return None
+    healthy = [e for e in candidates if not e.ejected(now)]
+    if not healthy:
+        return min(candidates, key=lambda e: e.ejected_until)
+    least = min(e.outstanding for e in healthy)
+    return random.choice([e for e in healthy if e.outstanding == least])
+
+
+def record_success(endpoint: Endpoint) -> None:
+    endpoint.failures = 0
+    endpoint.ejections = 0
+
+
+def record_failure(endpoint: Endpoint) -> None:
+    endpoint.failures += 1
+    if endpoint.failures < BACKEND_EJECT_FAILURES:
+        return
+    endpoint.failures = 0
+    endpoint.ejections += 1
+    duration = min(BACKEND_EJECT_SECONDS * 2 ** (endpoint.ejections - 1), BACKEND_EJECT_MAX_SECONDS)
+    endpoint.ejected_until = time.monotonic() + duration
+    print(f"Ejecting backend {endpoint.base_url} for {duration:.0f}s")
+
+
+def all_endpoints() -> list:
+    return list(_endpoints.values())
+
+
+def endpoint_stats() -> dict:
+    now = time.monotonic()
+    endpoints = list(_endpoints.values())
+    return {
+        "endpoints": len(endpoints),
+        "ejected": sum(1 for e in endpoints if e.ejected(now)),
+        "outstanding": sum(e.outstanding for e in endpoints),
+        "long_lived": sum(e.long_lived for e in endpoints),
+    }
@@ -1,8 +1,19 @@
 """Game proxy: single entry point for clients."""
-from fastapi import FastAPI, Request, HTTPException
+import asyncio
+import json
+
+from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 
-from backend_client import forward_json, health_backend, shutdown_client, startup_client
+from backend_client import fetch_raw, forward_raw, health_backend, shutdown_client, startup_client
+from match_events import (
+    start_match_events,
+    stop_match_events,
+    subscribe_player,
+    subscribe_session,
+    unsubscribe,
+)
+from status_cache import cached_fetch
 
 
 app = FastAPI(title="Game Proxy", version="0.1.0")
@@ -11,10 +22,12 @@ app = FastAPI(title="Game Proxy", version="0.1.0")
 @app.on_event("startup")
 async def startup() -> None:
     await startup_client()
+    start_match_events()
 
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
+    await stop_match_events()
     await shutdown_client()
 
 
@@ -42,7 +55,7 @@ async def proxy_join(request: Request):
     """
     body = await request.body()
     content_type = request.headers.get("content-type", "application/json")
-    return await forward_json(
+    return await forward_raw(
         "POST",
         "/match/join",
         content=body,
@@ -54,26 +67,169 @@ async def proxy_join(request: Request):
 @app.post("/api/match/{session_id}/end")
 async def proxy_end(session_id: str, request: Request):
     """Forward /match/{session_id}/end to backend."""
-    return await forward_json(
+    return await forward_raw(
         "POST",
         f"/match/{session_id}/end",
         timeout=15.0,
     )
 
 
+@app.post("/api/matches/end")
+async def proxy_end_many(request: Request):
+    """Forward a batch end ({"session_ids": [...]}) to backend /matches/end."""
+    body = await request.body()
+    return await forward_raw(
+        "POST",
+        "/matches/end",
+        content=body,
+        headers={"content-type": request.headers.get("content-type", "application/json")},
+        timeout=30.0,
+    )
+
+
 @app.get("/api/match/status")
 async def proxy_match_status(player_id: str):
-    """Forward status so queued clients can poll until matched and get game server address."""
-    return await forward_json(
+    """
+    Forward status so queued clients can poll until matched and get game server address.
+    Served from a sub-second per-player cache; concurrent polls share one backend call.
+    """
+    return await cached_fetch(
+        player_id,
+        lambda: fetch_raw(
+            "GET",
+            "/match/status",
+            params={"player_id": player_id},
+            timeout=5.0,
+            hedge=True,
+        ),
+    )
+
+
+@app.get("/api/match/wait")
+async def proxy_match_wait(request: Request):
+    """
+    Forward the long-poll / SSE match wait. The connection stays open until the
+    backend reports the player matched or ended, streamed straight through.
+    """
+    params = dict(request.query_params)
+    try:
+        wait_timeout = min(float(params.get("timeout", 25.0)), 60.0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid timeout")
+    return await forward_raw(
         "GET",
-        "/match/status",
-        params={"player_id": player_id},
-        timeout=5.0,
+        "/match/wait",
+        params=params,
+        timeout=wait_timeout + 5.0,
+        long_lived=True,
     )
 
 
 @app.get("/api/sessions/active")
-async def proxy_active_sessions():
-    """Forward /sessions/active to backend."""
-    return await forward_json("GET", "/sessions/active", timeout=5.0)
+async def proxy_active_sessions(request: Request):
+    """
+    Forward /sessions/active to backend, streaming the body through unparsed.
+    Supports cursor/limit pagination and format=ndjson for large fleets.
+    """
+    return await forward_raw(
+        "GET",
+        "/sessions/active",
+        params=dict(request.query_params),
+        timeout=30.0,
+        long_lived=True,
+    )
+
 
+async def _ws_backend_call(websocket: WebSocket, msg_type: str, method: str, path: str, **kwargs) -> None:
+    """Run a backend call and send its raw JSON body to the client as {"type": msg_type, "data": ...}."""
+    try:
+        status_code, _headers, body = await fetch_raw(method, path, **kwargs)
+    except HTTPException as e:
+        await websocket.send_text(json.dumps({"type": "error", "op": msg_type, "detail": e.detail}))
+        return
+    if status_code != 200:
+        await websocket.send_text(
+            json.dumps({"type": "error", "op": msg_type, "status_code": status_code, "detail": body.decode()})
+        )
+        return
+    await websocket.send_text(f'{{"type": "{msg_type}", "data": {body.decode()}}}')
+
+
+async def _ws_pump_events(websocket: WebSocket, queue: asyncio.Queue, session_ids: set, latest: dict) -> None:
+    while True:
+        event, text = await queue.get()
+        session_id = event.get("session_id")
+        if session_id and session_id not in session_ids:
+            # Follow the player's session so its "ended" event reaches us too.
+            session_ids.add(session_id)
+            latest["session_id"] = session_id
+            subscribe_session(queue, session_id)
+        await websocket.send_text(text)
+
+
+@app.websocket("/api/match/ws")
+async def match_ws(websocket: WebSocket):
+    """
+    One persistent connection per client for the whole matchmaking flow.
+
+    Client -> proxy (JSON text frames):
+      {"op": "join", "player_id": "..."}    enqueue (extra fields go to /match/join)
+      {"op": "status"}                     current status of the joined player
+      {"op": "end", "session_id": "..."}   end the match (defaults to the last session)
+    Proxy -> client:
+      {"type": "join" | "status" | "end", ...}  replies and pushed status events
+      {"type": "error", ...}
+    Status events are pushed from the Redis match_events feed, so idle waiting
+    players cost no backend requests.
+    """
+    await websocket.accept()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=32)
+    player_ids: set = set()
+    session_ids: set = set()
+    # Most recently seen session; the default target of "end".
+    latest: dict = {"session_id": None}
+    pump = asyncio.create_task(_ws_pump_events(websocket, queue, session_ids, latest))
+    try:
+        while True:
+            try:
+                msg = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_text(json.dumps({"type": "error", "detail": "Invalid JSON"}))
+                continue
+            op = msg.get("op") if isinstance(msg, dict) else None
+            if op == "join" and msg.get("player_id"):
+                player_id = str(msg["player_id"])
+                # Subscribe before joining so a match formed by this join is not missed.
+                player_ids.add(player_id)
+                subscribe_player(queue, player_id)
+                payload = {k: v for k, v in msg.items() if k != "op"}
+                await _ws_backend_call(
+                    websocket,
+                    "join",
+                    "POST",
+                    "/match/join",
+                    content=json.dumps(payload).encode(),
+                    headers={"content-type": "application/json"},
+                    timeout=10.0,
+                )
+            elif op == "status" and player_ids:
+                for player_id in player_ids:
+                    await _ws_backend_call(
+                        websocket,
+                        "status",
+                        "GET",
+                        "/match/status",
+                        params={"player_id": player_id},
+                        timeout=5.0,
+                        hedge=True,
+                    )
+            elif op == "end" and (msg.get("session_id") or latest["session_id"]):
+                session_id = msg.get("session_id") or latest["session_id"]
+                await _ws_backend_call(websocket, "end", "POST", f"/match/{session_id}/end", timeout=15.0)
+            else:
+                await websocket.send_text(json.dumps({"type": "error", "detail": f"Unsupported op: {op}"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pump.cancel()
+        unsubscribe(queue, player_ids, session_ids)
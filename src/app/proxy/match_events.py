@@ -0,0 +1,107 @@
+"""Fan-out of backend match events (Redis pub/sub) to WebSocket clients."""
+import asyncio
+import json
+
+import redis.asyncio as redis
+
+from settings import MATCH_EVENTS_CHANNEL, REDIS_HOST, REDIS_PORT
+
+# One subscription per proxy process; each connected client owns a queue that
+# is indexed by the player and session ids it cares about.
+_player_queues: dict = {}  # player_id -> set of asyncio.Queue
+_session_queues: dict = {}  # session_id -> set of asyncio.Queue
+_task: asyncio.Task | None = None
+_redis_client = None
+
+
+def _deliver(queues: dict, key: str, event: dict, text: str) -> None:
+    for queue in queues.get(key, ()):
+        try:
+            queue.put_nowait((event, text))
+        except asyncio.QueueFull:
+            pass  # slow client; it can resync with a status request
+
+
+def _dispatch(event: dict) -> None:
+    text = json.dumps({"type": "status", **event})
+    for player_id in event.get("players") or ():
+        _deliver(_player_queues, player_id, event, text)
+    _deliver(_session_queues, event.get("session_id", ""), event, text)
+
+
+async def _run() -> None:
+    global _redis_client
+    while True:
+        pubsub = None
+        try:
+            if _redis_client is None:
+                _redis_client = redis.Redis(
+                    host=REDIS_HOST,
+                    port=REDIS_PORT,
+                    decode_responses=True,
+                    socket_connect_timeout=2,
+                )
+            pubsub = _redis_client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(MATCH_EVENTS_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    _dispatch(json.loads(message["data"]))
+                except ValueError:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            print(f"Match event subscription failed: {e}, resubscribing")
+            await asyncio.sleep(1.0)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:  # noqa: BLE001
+                    pass
+
+
+def start_match_events() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop_match_events() -> None:
+    global _task, _redis_client
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
+
+
+def _index(queues: dict, key: str | None, queue: asyncio.Queue) -> None:
+    if key:
+        queues.setdefault(key, set()).add(queue)
+
+
+def _unindex(queues: dict, key: str | None, queue: asyncio.Queue) -> None:
+    subs = queues.get(key) if key else None
+    if subs is not None:
+        subs.discard(queue)
+        if not subs:
+            del queues[key]
+
+
+def subscribe_player(queue: asyncio.Queue, player_id: str) -> None:
+    _index(_player_queues, player_id, queue)
+
+
+def subscribe_session(queue: asyncio.Queue, session_id: str) -> None:
+    _index(_session_queues, session_id, queue)
+
+
+def unsubscribe(queue: asyncio.Queue, player_ids: set, session_ids: set) -> None:
+    for player_id in player_ids:
+        _unindex(_player_queues, player_id, queue)
+    for session_id in session_ids:
+        _unindex(_session_queues, session_id, queue)
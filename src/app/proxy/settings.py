@@ -0,0 +1,44 @@
+import os
+
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://game-backend:8080")
+
+# /api/match/status responses are cached per player_id for this long and
+# concurrent identical polls share one upstream request.
+STATUS_CACHE_TTL_SECONDS = float(os.getenv("STATUS_CACHE_TTL_SECONDS", "0.5"))
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "50000"))
+
+# Redis pub/sub feed of match events for the WebSocket gateway
+REDIS_HOST = os.getenv("REDIS_HOST", "redis.databases.svc.cluster.local")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+MATCH_EVENTS_CHANNEL = os.getenv("MATCH_EVENTS_CHANNEL", "match_events")
+
+# Client-side load balancing over backend pods. When BACKEND_HEADLESS_HOST is
+# set (a headless Service), the proxy resolves pod IPs itself and refreshes
+# them every BACKEND_DNS_REFRESH_SECONDS; otherwise everything goes to BACKEND_URL.
+BACKEND_HEADLESS_HOST = os.getenv("BACKEND_HEADLESS_HOST", "")
+BACKEND_PORT = int(os.getenv("BACKEND_PORT", "8080"))
+BACKEND_DNS_REFRESH_SECONDS = float(os.getenv("BACKEND_DNS_REFRESH_SECONDS", "5"))
+# Short requests in flight per backend pod before it is skipped (503 when all are
+# full). Long-lived streams (/match/wait, /sessions/active) are not capped.
+BACKEND_MAX_OUTSTANDING = int(os.getenv("BACKEND_MAX_OUTSTANDING", "256"))
+# Circuit breaker: this many consecutive failures (errors, 5xx, slow reads)
+# eject a pod for BACKEND_EJECT_SECONDS, doubling per repeat up to the max.
+BACKEND_EJECT_FAILURES = int(os.getenv("BACKEND_EJECT_FAILURES", "3"))
+BACKEND_EJECT_SECONDS = float(os.getenv("BACKEND_EJECT_SECONDS", "5"))
+BACKEND_EJECT_MAX_SECONDS = float(os.getenv("BACKEND_EJECT_MAX_SECONDS", "60"))
+BACKEND_SLOW_SECONDS = float(os.getenv("BACKEND_SLOW_SECONDS", "2"))
+# Idempotent short GETs are hedged to a second pod after this delay; attempts
+# (first try + hedges/retries) are capped at BACKEND_MAX_ATTEMPTS.
+BACKEND_HEDGE_DELAY_SECONDS = float(os.getenv("BACKEND_HEDGE_DELAY_SECONDS", "0.2"))
+BACKEND_MAX_ATTEMPTS = int(os.getenv("BACKEND_MAX_ATTEMPTS", "2"))
+
+# Proxy -> backend transport. BACKEND_HTTP2=1 speaks HTTP/2 with prior
+# knowledge (h2c) and needs the backend started with BACKEND_HTTP2=1 too.
+BACKEND_HTTP2 = os.getenv("BACKEND_HTTP2", "0") == "1"
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "200"))
+BACKEND_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BACKEND_MAX_KEEPALIVE_CONNECTIONS", "100"))
+BACKEND_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("BACKEND_KEEPALIVE_EXPIRY_SECONDS", "30"))
+# Connections opened to each backend pod at startup and when a pod appears
+# (HTTP/2 multiplexes everything over one, so it prewarms a single connection).
+BACKEND_PREWARM_CONNECTIONS = int(os.getenv("BACKEND_PREWARM_CONNECTIONS", "4"))
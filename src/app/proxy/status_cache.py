@@ -0,0 +1,50 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Awaitable, Callable
+
+from starlette.responses import Response
+
+from settings import STATUS_CACHE_MAX_ENTRIES, STATUS_CACHE_TTL_SECONDS
+
+# key -> (expires_at, status_code, headers, body); ordered oldest-used first.
+_entries: OrderedDict = OrderedDict()
+# key -> in-flight upstream fetch shared by concurrent callers (single-flight).
+_inflight: dict = {}
+
+
+def _to_response(entry) -> Response:
+    _expires_at, status_code, headers, body = entry
+    return Response(content=body, status_code=status_code, headers=headers)
+
+
+def _store(key: str, status_code: int, headers: dict, body: bytes) -> None:
+    if status_code != 200 or STATUS_CACHE_TTL_SECONDS <= 0:
+        return
+    _entries[key] = (time.monotonic() + STATUS_CACHE_TTL_SECONDS, status_code, headers, body)
+    _entries.move_to_end(key)
+    while len(_entries) > STATUS_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+
+
+async def cached_fetch(key: str, fetch: Callable[[], Awaitable[tuple[int, dict, bytes]]]) -> Response:
+    """
+    Serve key from the short-TTL cache, or run fetch once for all concurrent
+    callers with the same key and cache a 200 result.
+    """
+    entry = _entries.get(key)
+    if entry is not None:
+        if entry[0] > time.monotonic():
+            _entries.move_to_end(key)
+            return _to_response(entry)
+        del _entries[key]
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _inflight[key] = task
+        task.add_done_callback(lambda _t: _inflight.pop(key, None))
+    # shield: one caller disconnecting must not cancel the fetch the others wait on.
+    status_code, headers, body = await asyncio.shield(task)
+    _store(key, status_code, headers, body)
+    return Response(content=body, status_code=status_code, headers=headers)
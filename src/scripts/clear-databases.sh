@@ -16,5 +16,7 @@ kubectl exec deployment/postgres -n databases -- psql -U postgres -d app -c "DRO
 echo "Cleaning up orphaned game server pods and services..."
 kubectl delete deployment -l app=game-server --ignore-not-found || true
 kubectl delete service -l app=game-server --ignore-not-found || true
+# Bare game server pods (GAME_SERVER_MODE=pod) have no Deployment owning them.
+kubectl delete pod -l app=game-server --ignore-not-found || true
 
 echo "Databases cleared!"